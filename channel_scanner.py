@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental YouTube channel scanning.
+
+Every playlist (videos tab, shorts tab) keeps a watermark - the newest ID and
+date seen - and every listed ID is remembered in known_videos. A scan pages
+through the playlist from the top only until it reaches an already known ID,
+so its cost is proportional to the number of new uploads.
+
+Older videos are walked separately with a resumable backfill: one page per
+call and at most one per backfill_page_interval, the position is saved in
+scan_state and shifted when new uploads push the list down.
+"""
+import concurrent.futures
+import time
+
+from sync_store import chunked
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS scan_state (
+    playlist_url TEXT PRIMARY KEY,
+    newest_id TEXT,
+    newest_date TEXT,
+    backfill_offset INTEGER NOT NULL DEFAULT 0,
+    backfill_completed_at REAL,
+    backfill_at REAL,
+    updated_at REAL
+)
+'''
+
+KNOWN_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS known_videos (
+    y_id TEXT PRIMARY KEY,
+    playlist_url TEXT,
+    title TEXT,
+    upload_date TEXT,
+    first_seen_at REAL NOT NULL
+)
+'''
+
+PAGE_SIZE = 5
+MAX_PAGES = 20
+BACKFILL_PAGE_SIZE = 50
+# После полного прохода backfill начинается заново через неделю
+BACKFILL_INTERVAL = 7 * 24 * 3600
+# Во время прохода - не больше страницы за это время (а не yt-dlp на каждом запуске)
+BACKFILL_PAGE_INTERVAL = 6 * 3600
+
+
+class ChannelScanner:
+    def __init__(self, store, ytdlp, page_size=PAGE_SIZE, max_pages=MAX_PAGES,
+                 backfill_page_size=BACKFILL_PAGE_SIZE, backfill_interval=BACKFILL_INTERVAL,
+                 backfill_page_interval=BACKFILL_PAGE_INTERVAL):
+        """
+        :param store: SyncStore (общее соединение с DB_FILE)
+        :param ytdlp: YtDlpClient для листинга плейлистов
+        """
+        self.store = store
+        self.ytdlp = ytdlp
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.backfill_page_size = backfill_page_size
+        self.backfill_interval = backfill_interval
+        self.backfill_page_interval = backfill_page_interval
+        with store.transaction() as conn:
+            conn.execute(SCHEMA)
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(scan_state)')]
+            if 'backfill_at' not in columns:
+                conn.execute('ALTER TABLE scan_state ADD COLUMN backfill_at REAL')
+            conn.execute(KNOWN_SCHEMA)
+
+    def get_state(self, playlist_url):
+        rows = self.store.query(
+            '''SELECT newest_id, newest_date, backfill_offset, backfill_completed_at, backfill_at
+               FROM scan_state WHERE playlist_url = ?''', (playlist_url,))
+        if not rows:
+            return None
+        newest_id, newest_date, offset, completed_at, backfill_at = rows[0]
+        return {'newest_id': newest_id, 'newest_date': newest_date,
+                'backfill_offset': offset, 'backfill_completed_at': completed_at, 'backfill_at': backfill_at}
+
+    def known_ids(self, y_ids):
+        """IDs already seen by an earlier scan"""
+        known = set()
+        for part in chunked([y_id for y_id in y_ids if y_id]):
+            placeholders = ", ".join("?" * len(part))
+            rows = self.store.query(f'SELECT y_id FROM known_videos WHERE y_id IN ({placeholders})', part)
+            known.update(row[0] for row in rows)
+        return known
+
+    def remember(self, playlist_url, entries):
+        now = time.time()
+        with self.store.transaction() as conn:
+            for entry in entries:
+                conn.execute(
+                    '''INSERT OR IGNORE INTO known_videos (y_id, playlist_url, title, upload_date, first_seen_at)
+                       VALUES (?, ?, ?, ?, ?)''',
+                    (entry.get('id'), playlist_url, entry.get('title'), entry.get('upload_date'), now))
+
+    def scan_new(self, playlist_url):
+        """
+        Lists the playlist from the top until the first already known ID.
+        Returns (new_entries, ok); `ok` is False if the first page failed.
+        """
+        state = self.get_state(playlist_url)
+        new_entries = []
+        reached_known = False
+        ok = True
+
+        for page in range(self.max_pages):
+            start = page * self.page_size + 1
+            entries, page_ok = self.ytdlp.list_playlist(playlist_url, start, start + self.page_size - 1)
+            if not page_ok and page == 0:
+                ok = False
+            if not entries:
+                break
+
+            known = self.known_ids([e.get('id') for e in entries])
+            for entry in entries:
+                if entry.get('id') in known:
+                    reached_known = True
+                else:
+                    new_entries.append(entry)
+
+            # Первый запуск без водяного знака: одной страницы достаточно,
+            # остальное пройдет backfill
+            if reached_known or state is None or len(entries) < self.page_size:
+                break
+
+        if not ok:
+            return [], False
+
+        now = time.time()
+        newest = new_entries[0] if new_entries else None
+        with self.store.transaction() as conn:
+            self.remember(playlist_url, new_entries)
+            conn.execute(
+                '''INSERT INTO scan_state (playlist_url, newest_id, newest_date, updated_at) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(playlist_url) DO UPDATE SET
+                       newest_id = COALESCE(excluded.newest_id, newest_id),
+                       newest_date = COALESCE(excluded.newest_date, newest_date),
+                       -- новые видео сдвигают старые вниз по списку
+                       backfill_offset = backfill_offset + ?,
+                       updated_at = excluded.updated_at''',
+                (playlist_url, newest and newest.get('id'), newest and newest.get('upload_date'), now,
+                 len(new_entries) if state else 0))
+        return new_entries, True
+
+    def scan_many(self, playlist_urls, workers=None):
+        """
+        scan_new() for several playlists at once, each in its own thread.
+        Returns {playlist_url: (new_entries, ok)}.
+        """
+        playlist_urls = list(dict.fromkeys(playlist_urls))
+        if not playlist_urls:
+            return {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or len(playlist_urls)) as pool:
+            futures = {url: pool.submit(self.scan_new, url) for url in playlist_urls}
+            return {url: future.result() for url, future in futures.items()}
+
+    def backfill_page(self, playlist_url):
+        """
+        Lists the next page of older videos from the saved position.
+        Returns the entries of that page ([] when the walk is finished or
+        the previous page was listed less than backfill_page_interval ago).
+        """
+        state = self.get_state(playlist_url) or {'backfill_offset': 0, 'backfill_completed_at': None,
+                                                 'backfill_at': None}
+        completed_at = state['backfill_completed_at']
+        if completed_at and time.time() - completed_at < self.backfill_interval:
+            return []
+        if not completed_at and state['backfill_at'] and time.time() - state['backfill_at'] < self.backfill_page_interval:
+            return []
+
+        offset = 0 if completed_at else state['backfill_offset']
+        entries, ok = self.ytdlp.list_playlist(playlist_url, offset + 1, offset + self.backfill_page_size)
+        if not ok and not entries:
+            return []
+
+        finished = len(entries) < self.backfill_page_size
+        now = time.time()
+        with self.store.transaction() as conn:
+            self.remember(playlist_url, entries)
+            conn.execute(
+                '''INSERT INTO scan_state (playlist_url, backfill_offset, backfill_completed_at, backfill_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(playlist_url) DO UPDATE SET
+                       backfill_offset = excluded.backfill_offset,
+                       backfill_completed_at = excluded.backfill_completed_at,
+                       backfill_at = excluded.backfill_at,
+                       updated_at = excluded.updated_at''',
+                (playlist_url, 0 if finished else offset + len(entries), now if finished else None, now, now))
+        return entries
+
+
+def merge_entries(*entry_lists):
+    """
+    Merges playlist listings: one entry per ID, newest upload first. Entries
+    without upload_date keep their playlist order after the dated ones.
+    """
+    merged = {}
+    for entries in entry_lists:
+        for entry in entries:
+            if entry.get('id') and entry['id'] not in merged:
+                merged[entry['id']] = entry
+    return sorted(merged.values(), key=lambda e: e.get('upload_date') or '', reverse=True)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Resumable, integrity-checked video downloads into the media cache.
+
+yt-dlp keeps an interrupted download as `<file>.part` and resumes it on the
+next call, so a failed attempt is retried from where it stopped instead of
+from zero. A finished file is accepted only if its size matches the size
+yt-dlp reported for the format and ffprobe can read the container. The
+expected size and a SHA-256 (computed in chunks) are recorded in the cache
+index; a cached file is re-checked against them before it is reused.
+"""
+import hashlib
+import os
+import subprocess
+import threading
+import time
+
+HASH_CHUNK_SIZE = 1024 * 1024
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+def sha256_file(path, chunk_size=HASH_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def probe(path, ffprobe_path="ffprobe"):
+    """
+    True if ffprobe reads a positive duration from the container.
+    None if ffprobe is not installed (the check is skipped then).
+    """
+    cmd = [ffprobe_path, "-v", "error", "-show_entries", "format=duration",
+           "-of", "default=noprint_wrappers=1:nokey=1", path]
+    try:
+        res = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+    except FileNotFoundError:
+        return None
+    except subprocess.TimeoutExpired:
+        return False
+    try:
+        return res.returncode == 0 and float(res.stdout.strip()) > 0
+    except ValueError:
+        return False
+
+
+class DownloadManager:
+    def __init__(self, ytdlp, media_cache, attempts=3, ffprobe_path="ffprobe", log=print):
+        """
+        :param ytdlp: YtDlpClient
+        :param media_cache: MediaCache, в индекс которого пишутся размер и хэш
+        :param attempts: Сколько раз докачивать файл за один вызов
+        """
+        self.ytdlp = ytdlp
+        self.media_cache = media_cache
+        self.attempts = attempts
+        self.ffprobe_path = ffprobe_path
+        self.log = log
+
+    def check(self, path, expected_size=None):
+        """Returns an error string, or None if the file looks complete"""
+        size = os.path.getsize(path)
+        if expected_size and size != expected_size:
+            return f"size mismatch: {size} of {expected_size} bytes"
+        if probe(path, self.ffprobe_path) is False:
+            return "ffprobe could not read the container"
+        return None
+
+    def download(self, y_id, path, format):
+        """MediaCache download callback: (ok, error)"""
+        error = None
+        for attempt in range(1, self.attempts + 1):
+            resumed_from = os.path.getsize(path + ".part") if os.path.exists(path + ".part") else 0
+            if resumed_from:
+                self.log(f"⏯️ Докачка {y_id}: уже есть {resumed_from // (1024 * 1024)} MB")
+            started = time.time()
+            info, error = self.ytdlp.download(y_id, path, format)
+            if info is None or not os.path.exists(path):
+                self.log(f"⚠️ Скачивание {y_id}, попытка {attempt}/{self.attempts}: {error}")
+                continue
+            self.log_throughput(y_id, os.path.getsize(path) - resumed_from, time.time() - started)
+
+            expected_size = info.get('filesize')
+            error = self.check(path, expected_size)
+            if error:
+                # Битый файл не докачать: начинаем заново
+                self.log(f"⚠️ Файл {y_id} поврежден ({error}), удаляем")
+                os.remove(path)
+                continue
+
+            self.media_cache.record_integrity(y_id, format, expected_size or os.path.getsize(path), sha256_file(path))
+            return True, None
+        return False, error
+
+    def tee(self, y_id, path, format, consumer, expected_size=None):
+        """
+        Downloads through a pipe (yt-dlp -o -) into `path` and, at the same
+        time, feeds the bytes to consumer(chunks) running in a thread - e.g. an
+        upload to an external host. The consumer reads behind the writer from
+        the file itself, so a slow upload never holds the download back and
+        memory stays constant. A download that fails or doesn't pass check()
+        aborts the consumer's stream.
+        Returns (ok, error, consumer result or None).
+        """
+        part = path + ".part"
+        state = {'written': 0, 'done': False, 'failed': False}
+        cond = threading.Condition()
+
+        def chunks():
+            with open(part, 'rb') as f:
+                while True:
+                    with cond:
+                        while f.tell() >= state['written'] and not state['done']:
+                            cond.wait(1)
+                        if state['failed']:
+                            raise OSError("download failed, upload aborted")
+                        available = state['written'] - f.tell()
+                        if available <= 0:
+                            return
+                    yield f.read(min(available, STREAM_CHUNK_SIZE))
+
+        result = {}
+
+        def run():
+            try:
+                result['value'] = consumer(chunks())
+            except Exception as e:
+                self.log(f"⚠️ Потоковая загрузка {y_id}: {e}")
+
+        started = time.time()
+        digest = hashlib.sha256()
+        thread = threading.Thread(target=run, daemon=True)
+        # Слот в BandwidthBudget занят, пока процесс yt-dlp не завершен
+        with self.ytdlp.stream(y_id, format) as proc, open(part, 'wb') as f:
+            thread.start()
+            for chunk in iter(lambda: proc.stdout.read(STREAM_CHUNK_SIZE), b''):
+                f.write(chunk)
+                f.flush()
+                digest.update(chunk)
+                with cond:
+                    state['written'] += len(chunk)
+                    cond.notify_all()
+            proc.wait()
+            stderr = proc.stderr.read().decode(errors='replace')
+
+        error = None
+        if proc.returncode != 0:
+            error = (stderr.strip().split('\n') or [""])[-1] or f"yt-dlp exit code {proc.returncode}"
+        elif not state['written']:
+            error = "empty download"
+        else:
+            error = self.check(part, expected_size)
+        with cond:
+            state['done'] = True
+            state['failed'] = bool(error)
+            cond.notify_all()
+        thread.join()
+
+        if error:
+            self.log(f"⚠️ Скачивание {y_id} через pipe: {error}")
+            os.remove(part)
+            return False, error, None
+
+        os.replace(part, path)
+        self.log_throughput(y_id, state['written'], time.time() - started)
+        self.media_cache.record_integrity(y_id, format, state['written'], digest.hexdigest())
+        return True, None, result.get('value')
+
+    def log_throughput(self, y_id, size, elapsed):
+        bandwidth = getattr(self.ytdlp, 'bandwidth', None)
+        limit = f", общий лимит {bandwidth.total_rate / 1e6:.1f} MB/s" if bandwidth and bandwidth.total_rate else ""
+        speed = size / elapsed / 1e6 if elapsed > 0 else 0
+        self.log(f"📶 {y_id}: {size / 1e6:.1f} MB за {elapsed:.1f} с ({speed:.2f} MB/s{limit})")
+
+    def validate(self, y_id, path, format):
+        """MediaCache validate callback for files already in the cache"""
+        record = self.media_cache.integrity(y_id, format)
+        if record is None:
+            # Файл из старого кэша без записи: проверяем и запоминаем
+            if self.check(path):
+                return False
+            self.media_cache.record_integrity(y_id, format, os.path.getsize(path), sha256_file(path))
+            return True
+
+        error = self.check(path, record['expected_size'])
+        if not error and sha256_file(path) != record['sha256']:
+            error = "sha256 mismatch"
+        if error:
+            self.log(f"⚠️ Кэшированный файл {y_id} не прошел проверку ({error})")
+            return False
+        return True
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+Uploads of local video files to public file hosts, so Rutube can import
+them by URL, and a cache of the resulting URLs by file hash.
+
+Hosts share the ExternalHost interface (Catbox, Litterbox, the local
+server); the caller orders them by their rolling health stats.
+
+The multipart body is streamed from disk: MultipartFile is a file-like
+object that yields the form preamble, the file in fixed-size chunks and the
+closing boundary, and knows its total length up front, so requests sends a
+Content-Length body at constant memory instead of building it in RAM. Upload
+progress (bytes/sec) goes to the log. Connection errors and 5xx responses are
+retried with a fresh stream from the start of the file.
+"""
+import os
+import time
+import uuid
+
+import requests
+
+CATBOX_URL = "https://catbox.moe/user/api.php"
+LITTERBOX_URL = "https://litterbox.catbox.moe/resources/internals/api.php"
+CHUNK_SIZE = 1024 * 1024
+# (connect, read): read - максимальная пауза между байтами, а не общее время
+TIMEOUT = (15, 120)
+RETRIES = 3
+RETRY_DELAY = 10
+# Медленнее этого (байт/сек) загрузка прерывается, чтобы перейти к другому хосту
+MIN_UPLOAD_SPEED = 200 * 1024
+# Первые секунды загрузки скорость не проверяется
+SLOW_GRACE = 30
+PROGRESS_INTERVAL = 10
+# Как часто перепроверять, что сохраненная ссылка еще жива
+LIVENESS_INTERVAL = 3600
+
+URLS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS external_urls (
+    sha256 TEXT NOT NULL,
+    host TEXT NOT NULL,
+    url TEXT NOT NULL,
+    size INTEGER,
+    uploaded_at REAL NOT NULL,
+    checked_at REAL,
+    PRIMARY KEY (sha256, host)
+)
+'''
+
+
+def multipart_envelope(boundary, file_field, filename, fields=None):
+    """(head, tail) bytes of a multipart/form-data body around one file"""
+    head = b""
+    for name, value in (fields or {}).items():
+        head += (f"--{boundary}\r\n"
+                 f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                 f"{value}\r\n").encode()
+    head += (f"--{boundary}\r\n"
+             f'Content-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+             f"Content-Type: application/octet-stream\r\n\r\n").encode()
+    return head, f"\r\n--{boundary}--\r\n".encode()
+
+
+class UploadTooSlow(OSError):
+    """Raised from read(); requests re-raises it wrapped, check MultipartFile.too_slow"""
+
+
+class MultipartFile:
+    """Read-only multipart/form-data body for one file plus simple text fields"""
+
+    def __init__(self, path, file_field, fields=None, chunk_size=CHUNK_SIZE, progress=None, min_speed=None):
+        """
+        :param progress: progress(sent_bytes, total_bytes), вызывается после каждого чтения
+        :param min_speed: Средняя скорость (байт/сек), ниже которой чтение прерывается UploadTooSlow
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.min_speed = min_speed
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+
+        self.head, self.tail = multipart_envelope(self.boundary, file_field, os.path.basename(path), fields)
+        self.file_size = os.path.getsize(path)
+        self.length = len(self.head) + self.file_size + len(self.tail)
+        self._file = None
+        self.seek(0)
+
+    def __len__(self):
+        return self.length
+
+    def seek(self, offset, whence=0):
+        """Only rewinding to the start is supported (used for retries)"""
+        if offset != 0 or whence != 0:
+            raise OSError("MultipartFile can only be rewound to the start")
+        self.close()
+        self._file = open(self.path, 'rb')
+        self._part = 0
+        self._pos = 0
+        self.sent = 0
+        self.started = time.time()
+        self.too_slow = None
+        return 0
+
+    def tell(self):
+        return self.sent
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.chunk_size
+        size = min(size, self.chunk_size)
+        data = b""
+        while len(data) < size and self._part < 3:
+            if self._part == 1:
+                chunk = self._file.read(size - len(data))
+                if not chunk:
+                    self._part, self._pos = 2, 0
+                    continue
+                data += chunk
+            else:
+                buf = self.head if self._part == 0 else self.tail
+                chunk = buf[self._pos:self._pos + size - len(data)]
+                self._pos += len(chunk)
+                data += chunk
+                if self._pos >= len(buf):
+                    self._part, self._pos = self._part + 1, 0
+        self.sent += len(data)
+        elapsed = time.time() - self.started
+        if self.min_speed and elapsed > SLOW_GRACE and self.sent / elapsed < self.min_speed:
+            self.too_slow = f"upload too slow: {self.sent / elapsed / 1024:.0f} KB/s"
+            raise UploadTooSlow(self.too_slow)
+        if self.progress and data:
+            self.progress(self.sent, self.length)
+        return data
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MultipartStream:
+    """
+    multipart/form-data body around an iterator of file chunks (a file that is
+    still being written). With a known `length` it has a Content-Length,
+    otherwise requests sends it chunked. Can't be rewound, so never retried.
+    """
+
+    def __init__(self, chunks, filename, file_field, fields=None, length=None, progress=None):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.head, self.tail = multipart_envelope(self.boundary, file_field, filename, fields)
+        self.chunks = chunks
+        self.length = len(self.head) + length + len(self.tail) if length else None
+        self.progress = progress
+
+    def __len__(self):
+        return self.length or 0
+
+    def __iter__(self):
+        sent = 0
+        for data in self._parts():
+            sent += len(data)
+            if self.progress:
+                self.progress(sent, self.length)
+            yield data
+
+    def _parts(self):
+        yield self.head
+        yield from self.chunks
+        yield self.tail
+
+
+class ProgressLog:
+    """Logs sent MB and average speed at most every `interval` seconds"""
+
+    def __init__(self, label, log=print, interval=PROGRESS_INTERVAL):
+        self.label = label
+        self.log = log
+        self.interval = interval
+        self.started = time.time()
+        self.last = self.started
+
+    def __call__(self, sent, total=None):
+        """total=None: size unknown (streaming a file that is still downloading)"""
+        now = time.time()
+        if now - self.last < self.interval and (not total or sent < total):
+            return
+        self.last = now
+        elapsed = max(now - self.started, 1e-6)
+        done = f"{sent / 1e6:.1f}/{total / 1e6:.1f} MB ({100 * sent / total:.0f}%" if total else f"{sent / 1e6:.1f} MB ("
+        self.log(f"📤 {self.label}: {done}, {sent / elapsed / 1e6:.2f} MB/s)")
+
+
+def upload_file(url, path, file_field, fields=None, log=print, label=None,
+                retries=RETRIES, retry_delay=RETRY_DELAY, timeout=TIMEOUT, min_speed=None):
+    """
+    Streams one file as multipart/form-data. Returns (response, error):
+    the last response (None if no attempt got one) and the last error text.
+    4xx responses and too slow uploads are not retried.
+    """
+    error = None
+    for attempt in range(1, retries + 1):
+        progress = ProgressLog(label or os.path.basename(path), log)
+        body = MultipartFile(path, file_field, fields, progress=progress, min_speed=min_speed)
+        try:
+            with body:
+                resp = requests.post(url, data=body, timeout=timeout,
+                                     headers={'Content-Type': body.content_type,
+                                              'Content-Length': str(len(body))})
+        except (requests.RequestException, OSError) as e:
+            if body.too_slow:
+                log(f"🐢 {label or path}: {body.too_slow}, переходим к следующему хосту")
+                return None, body.too_slow
+            error = str(e)
+        else:
+            if resp.status_code < 500:
+                return resp, None if resp.status_code == 200 else resp.text.strip()
+            error = f"HTTP {resp.status_code}: {resp.text.strip()[:200]}"
+        log(f"⚠️ Загрузка {label or path}, попытка {attempt}/{retries}: {error}")
+        if attempt < retries:
+            time.sleep(retry_delay * attempt)
+    return None, error
+
+
+class ExternalHost:
+    """
+    A place that serves a local file under a public URL Rutube can import.
+    upload() returns the URL or None. `cacheable` hosts keep the file, so
+    their URLs go to UrlCache.
+    """
+    name = None
+    cacheable = True
+
+    def upload(self, path, log=print):
+        raise NotImplementedError
+
+    def upload_stream(self, chunks, filename, length=None, log=print):
+        """Uploads while the file is still downloading; None if unsupported or failed"""
+        return None
+
+
+class CatboxHost(ExternalHost):
+    name = "catbox"
+    url = CATBOX_URL
+    fields = {'reqtype': 'fileupload'}
+
+    def __init__(self, retries=RETRIES, min_speed=MIN_UPLOAD_SPEED):
+        self.retries = retries
+        self.min_speed = min_speed
+
+    def upload(self, path, log=print):
+        resp, error = upload_file(self.url, path, 'fileToUpload', self.fields, log=log,
+                                  label=self.name, retries=self.retries, min_speed=self.min_speed)
+        if resp is not None and resp.status_code == 200 and resp.text.strip().startswith("http"):
+            return resp.text.strip()
+        log(f"❌ {self.name} error: {error or (resp.text.strip() if resp is not None else '')}")
+        return None
+
+    def upload_stream(self, chunks, filename, length=None, log=print):
+        body = MultipartStream(chunks, filename, 'fileToUpload', self.fields, length,
+                               progress=ProgressLog(f"{self.name} (stream)", log))
+        headers = {'Content-Type': body.content_type}
+        try:
+            resp = requests.post(self.url, data=body if length else iter(body), headers=headers, timeout=TIMEOUT)
+        except (requests.RequestException, OSError) as e:
+            log(f"❌ {self.name} stream error: {e}")
+            return None
+        if resp.status_code == 200 and resp.text.strip().startswith("http"):
+            return resp.text.strip()
+        log(f"❌ {self.name} stream error: HTTP {resp.status_code} {resp.text.strip()[:200]}")
+        return None
+
+
+class LitterboxHost(CatboxHost):
+    """Temporary Catbox storage (files expire after `expiry`: 1h, 12h, 24h or 72h)"""
+    name = "litterbox"
+    url = LITTERBOX_URL
+
+    def __init__(self, expiry="72h", **kwargs):
+        super().__init__(**kwargs)
+        self.fields = {'reqtype': 'fileupload', 'time': expiry}
+
+
+class LocalServerHost(ExternalHost):
+    """server_simple.py serves UPLOADS_DIR; nothing is uploaded"""
+    name = "local"
+    cacheable = False
+
+    def __init__(self, url_template):
+        """
+        :param url_template: URL с {filename}, например https://host/rutube-webhook/static/{filename}
+        """
+        self.url_template = url_template
+
+    def upload(self, path, log=print):
+        return self.url_template.format(filename=os.path.basename(path))
+
+
+HOSTS = {
+    CatboxHost.name: CatboxHost,
+    LitterboxHost.name: LitterboxHost,
+}
+
+
+def is_live(url, size=None, timeout=TIMEOUT):
+    """HEAD check: the URL answers 200 and, if known, with the expected Content-Length"""
+    try:
+        resp = requests.head(url, allow_redirects=True, timeout=timeout)
+    except requests.RequestException:
+        return False
+    if resp.status_code != 200:
+        return False
+    length = resp.headers.get('Content-Length')
+    return not (size and length and int(length) != size)
+
+
+class UrlCache:
+    """
+    External-host URLs of uploaded files keyed by content hash, so a file
+    goes to a host once: a retried or crashed video reuses the URL as long
+    as the host still serves it.
+    """
+
+    def __init__(self, store, liveness_interval=LIVENESS_INTERVAL):
+        """
+        :param store: SyncStore (общее соединение с DB_FILE)
+        """
+        self.store = store
+        self.liveness_interval = liveness_interval
+        with store.transaction() as conn:
+            conn.execute(URLS_SCHEMA)
+
+    def get(self, sha256, host):
+        """Live URL for the file on `host` or None (dead URLs are forgotten)"""
+        rows = self.store.query(
+            'SELECT url, size, checked_at FROM external_urls WHERE sha256 = ? AND host = ?', (sha256, host))
+        if not rows:
+            return None
+        url, size, checked_at = rows[0]
+        now = time.time()
+        if checked_at and now - checked_at < self.liveness_interval:
+            return url
+        if not is_live(url, size):
+            self.forget(sha256, host)
+            return None
+        self.store.execute('UPDATE external_urls SET checked_at = ? WHERE sha256 = ? AND host = ?',
+                           (now, sha256, host))
+        return url
+
+    def put(self, sha256, host, url, size=None):
+        now = time.time()
+        self.store.execute(
+            '''INSERT OR REPLACE INTO external_urls (sha256, host, url, size, uploaded_at, checked_at)
+               VALUES (?, ?, ?, ?, ?, ?)''', (sha256, host, url, size, now, now))
+
+    def forget(self, sha256, host):
+        self.store.execute('DELETE FROM external_urls WHERE sha256 = ? AND host = ?', (sha256, host))
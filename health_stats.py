@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Rolling success/latency statistics persisted in the sync database.
+
+Used to order interchangeable options (yt-dlp player clients, external hosts)
+by how well they have worked recently. Both numbers are exponentially
+weighted moving averages, so old results fade out and a client that starts
+failing drops down the list within a few calls. Every so often a random
+lower-ranked option is tried first, so a recovered one can climb back.
+"""
+import random
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS health_stats (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    successes INTEGER NOT NULL DEFAULT 0,
+    success_rate REAL NOT NULL DEFAULT 0.5,
+    avg_latency REAL,
+    last_success_at REAL,
+    updated_at REAL,
+    PRIMARY KEY (kind, name)
+)
+'''
+
+# Вес последнего результата в скользящем среднем
+ALPHA = 0.2
+# Доля вызовов, в которых первым пробуем не лучший вариант
+EXPLORE_RATE = 0.1
+# Оценка для вариантов без истории
+DEFAULT_RATE = 0.5
+
+
+class HealthStats:
+    def __init__(self, store, kind, alpha=ALPHA, explore_rate=EXPLORE_RATE):
+        """
+        :param store: SyncStore (общее соединение с DB_FILE)
+        :param kind: Группа статистики, например "ytdlp_client" или "external_host"
+        """
+        self.store = store
+        self.kind = kind
+        self.alpha = alpha
+        self.explore_rate = explore_rate
+        with store.transaction() as conn:
+            conn.execute(SCHEMA)
+
+    def record(self, name, ok, latency=None):
+        """Adds one result; latency in seconds (None = don't update latency)"""
+        now = time.time()
+        with self.store.transaction() as conn:
+            row = conn.execute(
+                'SELECT success_rate, avg_latency FROM health_stats WHERE kind = ? AND name = ?',
+                (self.kind, name)).fetchone()
+            rate, avg_latency = row if row else (DEFAULT_RATE, None)
+            rate = (1 - self.alpha) * rate + self.alpha * (1.0 if ok else 0.0)
+            if latency is not None:
+                avg_latency = latency if avg_latency is None else (1 - self.alpha) * avg_latency + self.alpha * latency
+            conn.execute(
+                '''INSERT INTO health_stats (kind, name, attempts, successes, success_rate, avg_latency, last_success_at, updated_at)
+                   VALUES (?, ?, 1, ?, ?, ?, ?, ?)
+                   ON CONFLICT(kind, name) DO UPDATE SET
+                       attempts = attempts + 1,
+                       successes = successes + excluded.successes,
+                       success_rate = excluded.success_rate,
+                       avg_latency = excluded.avg_latency,
+                       last_success_at = COALESCE(excluded.last_success_at, last_success_at),
+                       updated_at = excluded.updated_at''',
+                (self.kind, name, 1 if ok else 0, rate, avg_latency, now if ok else None, now))
+
+    def get(self):
+        """{name: {'success_rate', 'avg_latency', 'attempts'}}"""
+        rows = self.store.query(
+            'SELECT name, success_rate, avg_latency, attempts FROM health_stats WHERE kind = ?', (self.kind,))
+        return {name: {'success_rate': rate, 'avg_latency': latency, 'attempts': attempts}
+                for name, rate, latency, attempts in rows}
+
+    def order(self, names, explore=True):
+        """
+        Sorts options by recent success rate, then by latency. Ties keep the
+        given order, so with no history the configured order is used.
+        """
+        stats = self.get()
+
+        def key(item):
+            index, name = item
+            s = stats.get(name, {})
+            latency = s.get('avg_latency')
+            return (-round(s.get('success_rate', DEFAULT_RATE), 2),
+                    latency if latency is not None else float('inf'),
+                    index)
+
+        ordered = [name for _, name in sorted(enumerate(names), key=key)]
+        if explore and len(ordered) > 1 and random.random() < self.explore_rate:
+            ordered.insert(0, ordered.pop(random.randrange(1, len(ordered))))
+        return ordered
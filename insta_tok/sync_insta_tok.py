@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import atexit
 import os
 import sys
 import datetime
@@ -20,10 +21,22 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_FILE = os.path.join(BASE_DIR, "sync.db")
 TIKTOK_COOKIES_FILE = os.path.join(BASE_DIR, "tiktok_cookies.txt")
 YT_DLP_PATH = os.path.abspath(os.path.join(BASE_DIR, "../yt-dlp")) # Assuming it's in parent dir
-DOWNLOAD_DIR = os.path.join(BASE_DIR, "downloads")
 
-# Ensure download directory exists
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+# Общий с sync_production кэш видео: одно скачивание на оба пайплайна
+sys.path.append(os.path.dirname(BASE_DIR))
+from download_manager import DownloadManager
+from media_cache import MediaCache
+from ytdlp_client import YtDlpClient
+try:
+    import config
+    DEFAULT_CACHE_DIR = getattr(config, "MEDIA_CACHE_DIR", config.UPLOADS_DIR)
+except ImportError:
+    DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(BASE_DIR), "uploads")
+MEDIA_CACHE_DIR = os.path.abspath(os.getenv("MEDIA_CACHE_DIR") or DEFAULT_CACHE_DIR)
+YOUTUBE_COOKIES_FILE = os.path.join(os.path.dirname(BASE_DIR), "youtube_cookies.txt")
+CONSUMER = "insta_tok"
+# Один кэш на весь запуск (создается в get_media_cache())
+media_cache = None
 
 def log(msg):
     print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}")
@@ -54,19 +67,22 @@ def mark_video_synced(y_id, title, tiktok_status, insta_status):
     conn.commit()
     conn.close()
 
+def get_media_cache():
+    global media_cache
+    if media_cache is None:
+        media_cache = MediaCache(MEDIA_CACHE_DIR)
+        atexit.register(media_cache.close)
+    return media_cache
+
 def download_video(y_id):
     log(f"⬇️ Downloading video {y_id}...")
-    file_base = os.path.join(DOWNLOAD_DIR, y_id)
-    # Output template: id.mp4
-    cmd = [YT_DLP_PATH, "-f", "best[ext=mp4]"]
-    if os.path.exists("../youtube_cookies.txt"): cmd.insert(1, "--cookies"); cmd.insert(2, "../youtube_cookies.txt")
-    # OLD: cmd = [YT_DLP_PATH, "-f", "best[ext=mp4]", "-o", f"{file_base}.%(ext)s", f"https://youtube.com/watch?v={y_id}"]
-    res = subprocess.run(cmd, capture_output=True, text=True)
-    if res.returncode == 0:
-        video_path = f"{file_base}.mp4"
-        if os.path.exists(video_path):
-            return video_path
-    log(f"❌ Download failed: {res.stderr}")
+    cookie_file = YOUTUBE_COOKIES_FILE if os.path.exists(YOUTUBE_COOKIES_FILE) else None
+    media_cache = get_media_cache()
+    manager = DownloadManager(YtDlpClient(YT_DLP_PATH, cookie_file), media_cache, log=log)
+    video_path, error = media_cache.acquire(y_id, [CONSUMER], manager.download, validate=manager.validate)
+    if video_path:
+        return video_path
+    log(f"❌ Download failed: {error}")
     return None
 
 def upload_to_tiktok(video_path, caption):
@@ -154,6 +170,8 @@ def sync():
         title = vid.get('title', 'No Title')
         
         if is_video_synced(y_id):
+            # sync_production резервирует файл и для нас: ссылку снимаем, раз видео уже отправлено
+            get_media_cache().release(y_id, CONSUMER)
             continue
             
         log(f"🆕 Found new video: {title} ({y_id})")
@@ -181,11 +199,8 @@ def sync():
             
             mark_video_synced(y_id, title, tiktok_status, insta_status)
             
-            # Cleanup
-            try:
-                os.remove(video_path)
-            except:
-                pass
+            # Cleanup: файл удалится, когда он не нужен и sync_production
+            get_media_cache().release(y_id, CONSUMER)
             
             # Process only one new video per run to avoid spamming/rate limits
             return
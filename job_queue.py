@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""
+Durable job queue in the sync SQLite database.
+
+One job per (video, platform). The scanner enqueues jobs, workers claim them
+with a lease. A crashed worker's lease simply expires and another run (or
+another process on the same DB) picks the job up again.
+
+States: pending -> running -> done
+                          \\-> pending (retry after next_attempt_at)
+                          \\-> failed  (attempts exhausted)
+
+Failures are also tracked per video (video_failures) with exponential
+backoff, so a video whose metadata or download keeps failing is skipped
+until its next allowed attempt instead of blocking the queue every run.
+"""
+import json
+import os
+import socket
+import time
+
+LEASE_SECONDS = 3600
+# Экспоненциальная задержка повтора: RETRY_DELAY * 2^(n-1), не больше MAX_RETRY_DELAY
+RETRY_DELAY = 3 * 3600
+MAX_RETRY_DELAY = 7 * 24 * 3600
+MAX_ATTEMPTS = 8
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    y_id TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires_at REAL,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    payload TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (y_id, platform)
+)
+'''
+
+FAILURES_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS video_failures (
+    y_id TEXT PRIMARY KEY,
+    failures INTEGER NOT NULL DEFAULT 0,
+    stage TEXT,
+    last_error TEXT,
+    last_failure_at REAL,
+    next_attempt_at REAL NOT NULL DEFAULT 0
+)
+'''
+
+# Задача доступна для захвата, если она ждет и время пришло,
+# или если ее владелец не продлил аренду (упал/завис).
+CLAIMABLE = '''
+((state = 'pending' AND next_attempt_at <= :now)
+ OR (state = 'running' AND lease_expires_at < :now))
+'''
+
+
+def backoff_delay(failures, base=RETRY_DELAY, cap=MAX_RETRY_DELAY):
+    """Delay before the next attempt after `failures` consecutive failures"""
+    return min(base * 2 ** max(0, failures - 1), cap)
+
+
+def default_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    def __init__(self, store, owner=None, lease_seconds=LEASE_SECONDS,
+                 retry_delay=RETRY_DELAY, max_retry_delay=MAX_RETRY_DELAY, max_attempts=MAX_ATTEMPTS):
+        """
+        :param store: SyncStore (общее соединение с DB_FILE)
+        """
+        self.store = store
+        self.owner = owner or default_owner()
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        with store.transaction() as conn:
+            conn.execute(SCHEMA)
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, next_attempt_at)')
+            conn.execute(FAILURES_SCHEMA)
+
+    def enqueue(self, y_id, platform, payload=None):
+        """Adds a job unless one already exists. Returns True if it was added."""
+        return self.enqueue_many([(y_id, platform, payload)]) > 0
+
+    def enqueue_many(self, jobs):
+        """
+        Adds many jobs in one transaction, skipping existing ones.
+        jobs: iterable of (y_id, platform, payload). Returns the number added.
+        """
+        now = time.time()
+        added = 0
+        with self.store.transaction() as conn:
+            for y_id, platform, payload in jobs:
+                # Новая задача для видео "на паузе" тоже ждет окончания паузы
+                cursor = conn.execute(
+                    '''INSERT OR IGNORE INTO jobs (y_id, platform, payload, next_attempt_at, created_at, updated_at)
+                       VALUES (?, ?, ?, COALESCE((SELECT next_attempt_at FROM video_failures WHERE y_id = ?), 0), ?, ?)''',
+                    (y_id, platform, json.dumps(payload, ensure_ascii=False) if payload else None, y_id, now, now))
+                added += cursor.rowcount
+        return added
+
+    def reopen(self, y_id, platform):
+        """
+        Returns a done or given-up job to the queue with a fresh attempt count
+        (its publication was lost and has to be redone). Returns True if one was reopened.
+        """
+        now = time.time()
+        return self.store.execute(
+            '''UPDATE jobs SET state = 'pending', attempts = 0, next_attempt_at = 0, last_error = NULL,
+               lease_owner = NULL, lease_expires_at = NULL, updated_at = ?
+               WHERE y_id = ? AND platform = ? AND state IN ('done', 'failed')''',
+            (now, y_id, platform)).rowcount > 0
+
+    def requeue(self, y_id, platform, error):
+        """
+        A done job turned out to have failed after all (Rutube gave up on the
+        posted video): counts an attempt and retries it with the usual backoff,
+        or gives it up. Returns True if the job was found.
+        """
+        now = time.time()
+        with self.store.transaction() as conn:
+            row = conn.execute("SELECT attempts FROM jobs WHERE y_id = ? AND platform = ? AND state = 'done'",
+                               (y_id, platform)).fetchone()
+            if row is None:
+                return False
+            next_attempt_at = now + backoff_delay(row[0] + 1, self.retry_delay, self.max_retry_delay)
+            conn.execute(
+                '''UPDATE jobs SET attempts = attempts + 1,
+                   state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                   next_attempt_at = ?, last_error = ?, updated_at = ? WHERE y_id = ? AND platform = ?''',
+                (self.max_attempts, next_attempt_at, str(error)[:1000], now, y_id, platform))
+        return True
+
+    def claim_next(self, require_platforms=(), exclude_platforms=()):
+        """
+        Atomically claims every claimable job of the next video.
+        `require_platforms`: only videos with a claimable job on one of these platforms.
+        `exclude_platforms`: skip videos that still have unfinished jobs on these
+        platforms (used to stop taking new Rutube uploads once the per-run limit is hit).
+        Returns (y_id, {platform: job}) or None when nothing is claimable.
+        """
+        now = time.time()
+        params = {'now': now}
+        filter_sql = ''
+        if require_platforms:
+            names = self._bind(params, 'r', require_platforms)
+            filter_sql += f' AND platform IN ({names})'
+        if exclude_platforms:
+            names = self._bind(params, 'x', exclude_platforms)
+            filter_sql += f'''
+                AND NOT EXISTS (SELECT 1 FROM jobs x WHERE x.y_id = jobs.y_id
+                                AND x.platform IN ({names})
+                                AND x.state IN ('pending', 'running'))'''
+
+        with self.store.transaction() as conn:
+            row = conn.execute(
+                f'SELECT y_id FROM jobs WHERE {CLAIMABLE} {filter_sql} ORDER BY created_at, rowid LIMIT 1',
+                params).fetchone()
+            if not row:
+                return None
+
+            y_id = row[0]
+            params['y_id'] = y_id
+            params['owner'] = self.owner
+            params['expires'] = now + self.lease_seconds
+            conn.execute(
+                f'''UPDATE jobs SET state = 'running', lease_owner = :owner, lease_expires_at = :expires,
+                    updated_at = :now WHERE y_id = :y_id AND {CLAIMABLE}''', params)
+            rows = conn.execute(
+                '''SELECT platform, attempts, last_error, payload FROM jobs
+                   WHERE y_id = ? AND state = 'running' AND lease_owner = ?''',
+                (y_id, self.owner)).fetchall()
+
+        jobs = {}
+        for platform, attempts, last_error, payload in rows:
+            jobs[platform] = {
+                'attempts': attempts,
+                'last_error': last_error,
+                'payload': json.loads(payload) if payload else {},
+            }
+        return y_id, jobs
+
+    @staticmethod
+    def _bind(params, prefix, values):
+        names = []
+        for i, value in enumerate(values):
+            params[f'{prefix}{i}'] = value
+            names.append(f':{prefix}{i}')
+        return ", ".join(names)
+
+    def _update_owned(self, sql, params):
+        return self.store.execute(sql, params).rowcount
+
+    def renew(self, y_id):
+        """Extends the lease on all jobs of the video held by this worker."""
+        now = time.time()
+        return self._update_owned(
+            '''UPDATE jobs SET lease_expires_at = ?, updated_at = ?
+               WHERE y_id = ? AND state = 'running' AND lease_owner = ?''',
+            (now + self.lease_seconds, now, y_id, self.owner))
+
+    def complete(self, y_id, platform):
+        now = time.time()
+        return self._update_owned(
+            '''UPDATE jobs SET state = 'done', lease_owner = NULL, lease_expires_at = NULL,
+               last_error = NULL, updated_at = ? WHERE y_id = ? AND platform = ?''',
+            (now, y_id, platform))
+
+    def fail(self, y_id, platform, error, next_attempt_at=None):
+        """
+        Records a failed attempt; the job is retried later or given up.
+        Without `next_attempt_at` the delay grows exponentially with the job's attempts.
+        """
+        now = time.time()
+        with self.store.transaction() as conn:
+            row = conn.execute('SELECT attempts FROM jobs WHERE y_id = ? AND platform = ?', (y_id, platform)).fetchone()
+            if next_attempt_at is None:
+                attempts = (row[0] if row else 0) + 1
+                next_attempt_at = now + backoff_delay(attempts, self.retry_delay, self.max_retry_delay)
+            return conn.execute(
+                '''UPDATE jobs SET attempts = attempts + 1,
+                   state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                   next_attempt_at = ?, last_error = ?, lease_owner = NULL, lease_expires_at = NULL,
+                   updated_at = ? WHERE y_id = ? AND platform = ? AND state = 'running' AND lease_owner = ?''',
+                (self.max_attempts, next_attempt_at, str(error)[:1000], now, y_id, platform, self.owner)).rowcount
+
+    def fail_video(self, y_id, stage, error):
+        """
+        Records a failure of the whole video (metadata, download, ...) and
+        fails all its jobs held by this worker with the same backoff.
+        Returns the time of the next allowed attempt.
+        """
+        now = time.time()
+        with self.store.transaction() as conn:
+            row = conn.execute('SELECT failures FROM video_failures WHERE y_id = ?', (y_id,)).fetchone()
+            failures = (row[0] if row else 0) + 1
+            next_attempt_at = now + backoff_delay(failures, self.retry_delay, self.max_retry_delay)
+            conn.execute(
+                '''INSERT OR REPLACE INTO video_failures (y_id, failures, stage, last_error, last_failure_at, next_attempt_at)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                (y_id, failures, stage, str(error)[:1000], now, next_attempt_at))
+            platforms = [r[0] for r in conn.execute(
+                "SELECT platform FROM jobs WHERE y_id = ? AND state = 'running' AND lease_owner = ?",
+                (y_id, self.owner))]
+            for platform in platforms:
+                self.fail(y_id, platform, f"{stage}: {error}", next_attempt_at)
+        return next_attempt_at
+
+    def clear_failures(self, y_id):
+        """The video made progress - forget its failure history"""
+        return self.store.execute('DELETE FROM video_failures WHERE y_id = ?', (y_id,)).rowcount
+
+    def backing_off(self):
+        """Videos currently waiting for their next allowed attempt: [(y_id, failures, next_attempt_at, stage)]"""
+        return self.store.query(
+            '''SELECT y_id, failures, next_attempt_at, stage FROM video_failures
+               WHERE next_attempt_at > ? ORDER BY next_attempt_at''', (time.time(),))
+
+    def release_owned(self):
+        """Returns every job still leased by this worker to the queue (no attempt counted)."""
+        now = time.time()
+        return self._update_owned(
+            '''UPDATE jobs SET state = 'pending', lease_owner = NULL, lease_expires_at = NULL,
+               updated_at = ? WHERE state = 'running' AND lease_owner = ?''',
+            (now, self.owner))
+
+    def has_claimable(self):
+        return bool(self.store.query(f'SELECT 1 FROM jobs WHERE {CLAIMABLE} LIMIT 1', {'now': time.time()}))
+
+    def claimable_ids(self, limit=50):
+        """IDs of videos with claimable jobs, in claim order (without claiming them)"""
+        rows = self.store.query(
+            f'''SELECT y_id FROM jobs WHERE {CLAIMABLE}
+                GROUP BY y_id ORDER BY MIN(created_at), MIN(rowid) LIMIT :limit''',
+            {'now': time.time(), 'limit': limit})
+        return [row[0] for row in rows]
+
+    def counts(self):
+        return dict(self.store.query('SELECT state, COUNT(*) FROM jobs GROUP BY state'))
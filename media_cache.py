@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Download-once local media cache shared by sync_production and insta_tok.
+
+Files are keyed by YouTube ID and yt-dlp format. Every pipeline that needs a
+file takes a reference for each of its consumers (platforms) and releases it
+when that platform is done; the file is deleted when the last reference goes.
+The index lives in its own SQLite file inside the cache directory, so both
+processes see the same references whatever their main database is.
+"""
+import contextlib
+import fcntl
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from ytdlp_client import DEFAULT_FORMAT
+
+INDEX_FILE = "media_cache.sqlite"
+# Файлы без обращений дольше этого срока удаляются даже с живыми ссылками
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media (
+    y_id TEXT NOT NULL,
+    format TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER,
+    expected_size INTEGER,
+    sha256 TEXT,
+    verified_at REAL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL,
+    PRIMARY KEY (y_id, format)
+)
+'''
+
+REFS_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media_refs (
+    y_id TEXT NOT NULL,
+    format TEXT NOT NULL,
+    consumer TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (y_id, format, consumer)
+)
+'''
+
+
+class MediaCache:
+    def __init__(self, cache_dir, index_file=None):
+        """
+        :param cache_dir: Каталог с видео (общий для всех пайплайнов)
+        :param index_file: SQLite-индекс, по умолчанию cache_dir/media_cache.sqlite
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(index_file or os.path.join(cache_dir, INDEX_FILE),
+                                    timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA busy_timeout=30000')
+        with self.transaction() as conn:
+            conn.execute(SCHEMA)
+            conn.execute(REFS_SCHEMA)
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(media)')]
+            for column, type_ in (('expected_size', 'INTEGER'), ('sha256', 'TEXT'), ('verified_at', 'REAL')):
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE media ADD COLUMN {column} {type_}')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            if self.conn.in_transaction:
+                yield self.conn
+                return
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def close(self):
+        with self.lock:
+            try:
+                self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error:
+                pass
+            self.conn.close()
+
+    def path_for(self, y_id, format=DEFAULT_FORMAT):
+        """
+        <id>.mp4 for the default format (the name the local server URL uses),
+        <id>.<format hash>.mp4 for any other format.
+        """
+        if format == DEFAULT_FORMAT:
+            return os.path.join(self.cache_dir, f"{y_id}.mp4")
+        digest = hashlib.sha1(format.encode()).hexdigest()[:8]
+        return os.path.join(self.cache_dir, f"{y_id}.{digest}.mp4")
+
+    def get(self, y_id, format=DEFAULT_FORMAT):
+        """Path of a complete cached file or None"""
+        path = self.path_for(y_id, format)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            return path
+        return None
+
+    @contextlib.contextmanager
+    def _file_lock(self, path):
+        """Only one process/thread downloads a given file at a time"""
+        with open(path + ".lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def acquire(self, y_id, consumers, download, format=DEFAULT_FORMAT, validate=None):
+        """
+        Takes a reference for every consumer and returns (path, error).
+        The file is downloaded with download(y_id, path, format) -> (ok, error)
+        only if it is not cached yet. validate(y_id, path, format) -> bool, if
+        given, checks a cached file; a file that fails it is downloaded again.
+        """
+        path = self.path_for(y_id, format)
+        now = time.time()
+        with self.transaction() as conn:
+            for consumer in consumers:
+                conn.execute(
+                    'INSERT OR IGNORE INTO media_refs (y_id, format, consumer, created_at) VALUES (?, ?, ?, ?)',
+                    (y_id, format, consumer, now))
+
+        error = None
+        with self._file_lock(path):
+            if validate and self.get(y_id, format) and not validate(y_id, path, format):
+                os.remove(path)
+            if not self.get(y_id, format):
+                ok, error = download(y_id, path, format)
+            if not self.get(y_id, format):
+                return None, error or "file is missing after download"
+
+        with self.lock:
+            self.conn.execute(
+                '''INSERT INTO media (y_id, format, path, size, created_at, last_used_at) VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(y_id, format) DO UPDATE SET
+                       path = excluded.path, size = excluded.size, last_used_at = excluded.last_used_at''',
+                (y_id, format, path, os.path.getsize(path), now, now))
+        return path, None
+
+    def integrity(self, y_id, format=DEFAULT_FORMAT):
+        """{'expected_size', 'sha256', 'verified_at'} recorded for the file, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT expected_size, sha256, verified_at FROM media WHERE y_id = ? AND format = ?',
+                (y_id, format)).fetchone()
+        if not row or row[1] is None:
+            return None
+        return {'expected_size': row[0], 'sha256': row[1], 'verified_at': row[2]}
+
+    def record_integrity(self, y_id, format, expected_size, sha256):
+        path = self.path_for(y_id, format)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                '''INSERT INTO media (y_id, format, path, size, expected_size, sha256, verified_at, created_at, last_used_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(y_id, format) DO UPDATE SET
+                       size = excluded.size, expected_size = excluded.expected_size,
+                       sha256 = excluded.sha256, verified_at = excluded.verified_at''',
+                (y_id, format, path, os.path.getsize(path), expected_size, sha256, now, now, now))
+
+    def release(self, y_id, consumer, format=DEFAULT_FORMAT):
+        """Drops one consumer's reference; deletes the file when none are left. Returns True if deleted."""
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM media_refs WHERE y_id = ? AND format = ? AND consumer = ?',
+                         (y_id, format, consumer))
+            left = conn.execute('SELECT COUNT(*) FROM media_refs WHERE y_id = ? AND format = ?',
+                                (y_id, format)).fetchone()[0]
+            if left:
+                return False
+            conn.execute('DELETE FROM media WHERE y_id = ? AND format = ?', (y_id, format))
+        return self._remove(self.path_for(y_id, format))
+
+    def prune(self, max_age=DEFAULT_MAX_AGE):
+        """
+        Removes files nobody used for max_age seconds (references left by
+        videos that were given up on), and references older than that to
+        files that were never downloaded. Returns the removed paths.
+        """
+        cutoff = time.time() - max_age
+        with self.transaction() as conn:
+            rows = conn.execute('SELECT y_id, format, path FROM media WHERE last_used_at < ?', (cutoff,)).fetchall()
+            for y_id, format, _ in rows:
+                conn.execute('DELETE FROM media_refs WHERE y_id = ? AND format = ?', (y_id, format))
+                conn.execute('DELETE FROM media WHERE y_id = ? AND format = ?', (y_id, format))
+            # acquire() берет ссылки до скачивания: после неудачного скачивания они остаются без файла
+            orphans = conn.execute(
+                '''SELECT DISTINCT y_id, format FROM media_refs r WHERE created_at < ? AND NOT EXISTS
+                   (SELECT 1 FROM media m WHERE m.y_id = r.y_id AND m.format = r.format)''', (cutoff,)).fetchall()
+            for y_id, format in orphans:
+                conn.execute('DELETE FROM media_refs WHERE y_id = ? AND format = ?', (y_id, format))
+        for y_id, format in orphans:
+            # Недокачанный .part тоже больше никому не нужен
+            self._remove(self.path_for(y_id, format))
+        return [path for _, _, path in rows if self._remove(path)]
+
+    def _remove(self, path):
+        removed = False
+        for p in (path, path + ".part", path + ".lock"):
+            try:
+                os.remove(p)
+                removed = removed or p == path
+            except FileNotFoundError:
+                pass
+        return removed
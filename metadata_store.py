@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Compact video metadata cache in the sync database.
+
+Only the fields the pipeline actually uses are kept (the full yt-dlp dump with
+every format and storyboard URL is thrown away), one row per video, so reads
+and writes are per-key instead of re-serializing a whole JSON file.
+
+Fields are split into classes with their own TTL: what the author can edit on
+YouTube (title, description, thumbnail) expires, what can't change (dimensions,
+duration, upload date) is kept forever. The table is capped at `max_entries`,
+least recently used rows are evicted first.
+"""
+import json
+import os
+import threading
+import time
+
+# Поля из yt-dlp --dump-json, которые нужны пайплайну
+MUTABLE_FIELDS = ('title', 'description', 'thumbnail')
+IMMUTABLE_FIELDS = ('width', 'height', 'duration', 'upload_date')
+FIELDS = MUTABLE_FIELDS + IMMUTABLE_FIELDS
+
+# TTL в секундах для каждого класса полей (None = бессрочно)
+DEFAULT_TTL = {
+    'mutable': 24 * 3600,
+    'immutable': None,
+}
+DEFAULT_MAX_ENTRIES = 5000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS video_metadata (
+    y_id TEXT PRIMARY KEY,
+    title TEXT,
+    description TEXT,
+    width INTEGER,
+    height INTEGER,
+    duration REAL,
+    upload_date TEXT,
+    thumbnail TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL
+)
+'''
+
+
+def project(info):
+    """Keeps only FIELDS from a yt-dlp info dict"""
+    return {field: info.get(field) for field in FIELDS}
+
+
+def field_class(field):
+    return 'mutable' if field in MUTABLE_FIELDS else 'immutable'
+
+
+class MetadataStore:
+    def __init__(self, store, ttl=None, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        :param store: SyncStore (общее соединение с DB_FILE)
+        :param ttl: {'mutable': секунды, 'immutable': секунды или None}
+        :param max_entries: Максимум записей, лишние вытесняются по LRU
+        """
+        self.store = store
+        self.ttl = dict(DEFAULT_TTL, **(ttl or {}))
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+        self._stats_lock = threading.Lock()
+        with store.transaction() as conn:
+            conn.execute(SCHEMA)
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(video_metadata)')]
+            if 'accessed_at' not in columns:
+                conn.execute('ALTER TABLE video_metadata ADD COLUMN accessed_at REAL')
+            conn.execute('CREATE INDEX IF NOT EXISTS video_metadata_lru ON video_metadata (accessed_at)')
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def is_fresh(self, fetched_at, fields, now=None):
+        now = now or time.time()
+        for cls in {field_class(f) for f in fields}:
+            ttl = self.ttl.get(cls)
+            if ttl is not None and now - fetched_at > ttl:
+                return False
+        return True
+
+    def get(self, y_id, fields=FIELDS):
+        """
+        Returns the requested fields if every one of them is still fresh,
+        otherwise None (the caller refetches and put()s the new data).
+        """
+        rows = self.store.query(
+            f'SELECT {", ".join(fields)}, fetched_at FROM video_metadata WHERE y_id = ?', (y_id,))
+        if not rows:
+            self._count('misses')
+            return None
+
+        now = time.time()
+        *values, fetched_at = rows[0]
+        if not self.is_fresh(fetched_at, fields, now):
+            self._count('misses')
+            self._count('expired')
+            return None
+
+        self._count('hits')
+        self.store.execute('UPDATE video_metadata SET accessed_at = ? WHERE y_id = ?', (now, y_id))
+        return dict(zip(fields, values), id=y_id)
+
+    def has_fresh(self, y_id, fields=FIELDS):
+        """Like get() is not None, but without counting a hit/miss or touching accessed_at"""
+        rows = self.store.query('SELECT fetched_at FROM video_metadata WHERE y_id = ?', (y_id,))
+        return bool(rows) and self.is_fresh(rows[0][0], fields, time.time())
+
+    def put(self, y_id, info):
+        data = project(info)
+        now = time.time()
+        self.store.execute(
+            f'''INSERT OR REPLACE INTO video_metadata (y_id, {", ".join(FIELDS)}, fetched_at, accessed_at)
+                VALUES (?, {", ".join("?" * len(FIELDS))}, ?, ?)''',
+            (y_id, *[data[f] for f in FIELDS], now, now))
+        self.evict()
+        return dict(data, id=y_id)
+
+    def evict(self):
+        """Drops least recently used rows above max_entries"""
+        if not self.max_entries:
+            return 0
+        excess = self.count() - self.max_entries
+        if excess <= 0:
+            return 0
+        cursor = self.store.execute(
+            '''DELETE FROM video_metadata WHERE y_id IN (
+                   SELECT y_id FROM video_metadata ORDER BY COALESCE(accessed_at, fetched_at) LIMIT ?)''',
+            (excess,))
+        self._count('evictions', cursor.rowcount)
+        return cursor.rowcount
+
+    def stats_line(self):
+        s = self.stats
+        total = s['hits'] + s['misses']
+        rate = f"{100 * s['hits'] / total:.0f}%" if total else "-"
+        return (f"hits={s['hits']} misses={s['misses']} (expired={s['expired']}) "
+                f"evictions={s['evictions']} hit_rate={rate} size={self.count()}")
+
+    def count(self):
+        return self.store.query('SELECT COUNT(*) FROM video_metadata')[0][0]
+
+    def import_json_cache(self, path):
+        """
+        One-time migration from the old video_metadata_cache.json.
+        The file is removed after a successful import.
+        """
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except Exception:
+            return 0
+
+        now = time.time()
+        with self.store.transaction() as conn:
+            for y_id, info in cache.items():
+                data = project(info)
+                conn.execute(
+                    f'''INSERT OR IGNORE INTO video_metadata (y_id, {", ".join(FIELDS)}, fetched_at, accessed_at)
+                        VALUES (?, {", ".join("?" * len(FIELDS))}, ?, ?)''',
+                    (y_id, *[data[f] for f in FIELDS], now, now))
+        os.remove(path)
+        self.evict()
+        return len(cache)
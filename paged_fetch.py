@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent fetching of paginated JSON listings (DRF style: results/next/count).
+
+The first page gives the total count and the page size, so the URLs of all
+other pages are known up front and can be fetched by a bounded thread pool.
+Pages are still yielded strictly in order. Every request waits for its
+host's rate limiter, and a failed page is retried with a growing delay
+before the whole listing is given up. Listings without a count fall back to
+following `next` one page at a time.
+"""
+import concurrent.futures
+import math
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+
+WORKERS = 4
+RETRIES = 3
+RETRY_DELAY = 1
+
+
+class RateLimiter:
+    def __init__(self, rate):
+        """
+        :param rate: Запросов в секунду (None или 0 - без ограничения)
+        """
+        self.interval = 1.0 / rate if rate else 0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class HostRateLimits:
+    """One RateLimiter per host"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.limiters = {}
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            limiter = self.limiters.setdefault(host, RateLimiter(self.rate))
+        limiter.wait()
+
+
+def page_url(url, page):
+    """`url` with its page query parameter set to `page`"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k != 'page']
+    query.append(('page', str(page)))
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def fetch_json(get, url, retries=RETRIES, retry_delay=RETRY_DELAY, log=print):
+    """get(url) -> Response, retried on network errors and non-200 answers. Returns the JSON."""
+    error = None
+    for attempt in range(1, retries + 1):
+        try:
+            r = get(url)
+            if r.status_code == 200:
+                return r.json()
+            error = f"HTTP {r.status_code}"
+        except (requests.RequestException, ValueError) as e:
+            error = str(e)
+        if attempt < retries:
+            log(f"⚠️ Страница {url}: {error}, повтор {attempt}/{retries - 1}")
+            time.sleep(retry_delay * 2 ** (attempt - 1))
+    raise requests.RequestException(f"{url}: {error}")
+
+
+def fetch_pages(get, url, workers=WORKERS, retries=RETRIES, retry_delay=RETRY_DELAY, log=print):
+    """
+    Yields the `results` of every page of the listing at `url`, in order.
+    Raises requests.RequestException when a page fails after all retries, or
+    when the count changes between pages (items shifted during the fetch).
+    """
+    data = fetch_json(get, url, retries, retry_delay, log)
+    results = data.get('results', [])
+    yield results
+
+    count = data.get('count')
+    if not data.get('next'):
+        return
+    if workers <= 1 or count is None or not results:
+        # Общее число неизвестно: идем по next
+        next_url = data['next']
+        while next_url:
+            data = fetch_json(get, next_url, retries, retry_delay, log)
+            yield data.get('results', [])
+            next_url = data.get('next')
+        return
+
+    per_page = data.get('per_page') or len(results)
+    first_page = int(dict(parse_qsl(urlsplit(url).query)).get('page', 1))
+    pages = range(first_page + 1, first_page + math.ceil(count / per_page))
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [pool.submit(fetch_json, get, page_url(data['next'], page), retries, retry_delay, log)
+                   for page in pages]
+        for future in futures:
+            page_data = future.result()
+            if page_data.get('count', count) != count:
+                raise requests.RequestException(
+                    f"listing changed during the fetch ({count} -> {page_data.get('count')} items)")
+            yield page_data.get('results', [])
+    finally:
+        # Остановились раньше (break или ошибка): невыполненные запросы отменяем
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Staged pipeline with bounded queues between stages.
+
+Each stage has its own pool of worker threads, so a slow stage (e.g. waiting
+for Rutube processing) does not stall the stages in front of it. A bounded
+queue between stages gives back-pressure: downloads don't run arbitrarily far
+ahead of uploads.
+
+Stage function contract (same convention as the rest of the project):
+    - return the item  -> pass it to the next stage
+    - return None      -> item is finished, nothing more to do
+    - return False     -> item failed at this stage
+    - raise            -> treated as a failure, logged with the stage name
+"""
+import queue
+import threading
+import datetime
+
+_STOP = object()
+
+
+def log(msg):
+    print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}")
+
+
+class Stage:
+    def __init__(self, name, func, workers=1, queue_size=2):
+        """
+        :param name: Имя стадии (для логов)
+        :param func: Функция обработки одного элемента
+        :param workers: Количество потоков-обработчиков
+        :param queue_size: Размер входной очереди стадии
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.threads = []
+
+
+class Pipeline:
+    def __init__(self, stages, describe=None, on_failure=None):
+        """
+        :param stages: Список Stage в порядке выполнения
+        :param describe: Функция item -> str для логов (по умолчанию str)
+        :param on_failure: Колбэк (item, stage_name, error) при ошибке элемента
+        """
+        self.stages = stages
+        self.describe = describe or str
+        self.on_failure = on_failure
+        self.completed = []
+        self.failed = []
+        self._lock = threading.Lock()
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+
+        while True:
+            item = stage.queue.get()
+            if item is _STOP:
+                return
+
+            error = None
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                log(f"❌ [{stage.name}] {self.describe(item)}: {e}")
+                error = str(e)
+                result = False
+
+            if result is False:
+                with self._lock:
+                    self.failed.append((item, stage.name))
+                if self.on_failure:
+                    try:
+                        self.on_failure(item, stage.name, error)
+                    except Exception as e:
+                        log(f"⚠️ on_failure error for {self.describe(item)}: {e}")
+            elif result is None:
+                with self._lock:
+                    self.completed.append(item)
+            elif next_stage:
+                next_stage.queue.put(result)
+            else:
+                with self._lock:
+                    self.completed.append(result)
+
+    def run(self, items):
+        """
+        Прогоняет элементы через все стадии и ждет завершения.
+        `items` может быть генератором: он читается по мере освобождения места
+        в первой очереди, так что сканирование идет параллельно с обработкой.
+        Возвращает (completed, failed).
+        """
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                t = threading.Thread(
+                    target=self._worker,
+                    args=(index,),
+                    name=f"{stage.name}-{n + 1}",
+                    daemon=True,
+                )
+                t.start()
+                stage.threads.append(t)
+
+        first = self.stages[0]
+        for item in items:
+            first.queue.put(item)
+
+        # Останавливаем стадии по порядку: следующая получает стоп-сигналы
+        # только когда все потоки предыдущей закончили работу.
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.queue.put(_STOP)
+            for t in stage.threads:
+                t.join()
+
+        return self.completed, self.failed
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+YouTube <-> Rutube reconciliation by fuzzy keys.
+
+Exact title equality breaks on any edited title or trimmed emoji, and every
+miss used to turn into a duplicate upload. Rutube videos are indexed by
+normalized title, duration bucket and upload date (hash maps, built once),
+so each YouTube video is compared only with the few candidates sharing a
+key: an equal normalized title, or a close duration within a few days of its
+upload. Candidates are scored on title similarity, duration and date, and
+matched one-to-one from the most confident pair down. Confirmed pairs are
+kept in video_mappings (YouTube ID -> Rutube ID), together with the ones
+recorded at upload time.
+"""
+import collections
+import datetime
+import difflib
+import re
+import time
+import unicodedata
+
+from metadata_store import SCHEMA as METADATA_SCHEMA
+
+# Длительность на Rutube после перекодирования может отличаться на секунду-другую
+DURATION_BUCKET = 5
+# Видео появляется на Rutube не раньше, чем на YouTube, и обычно в тот же день
+DATE_WINDOW_DAYS = 3
+# Вес признаков в итоговой уверенности
+WEIGHTS = {'title': 0.6, 'duration': 0.3, 'date': 0.1}
+# Оценка признака, которого нет у одной из сторон: одно похожее название ничего не доказывает,
+# а точное совпадение названия без других данных дает ровно CONFIRM
+UNKNOWN = 0.5
+# Пара с такой уверенностью записывается как совпадение
+CONFIRM = 0.8
+# Ниже этого порога кандидата не показываем вовсе
+POSSIBLE = 0.5
+# Видео с такими статусами на Rutube фактически нет: с ними не сопоставляем
+DEAD_STATUSES = ('error', 'deleted')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS video_mappings (
+    y_id TEXT PRIMARY KEY,
+    rutube_id TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    method TEXT NOT NULL,
+    created_at REAL NOT NULL
+)
+'''
+
+
+def normalize_title(title):
+    """Casefolded letters and digits only: no emoji, word hashtags, punctuation or extra spaces"""
+    text = unicodedata.normalize('NFKC', title or '').casefold()
+    # Числовые хэштеги (#2) - это номер серии, их оставляем
+    text = re.sub(r'#(?!\d+\b)\w+', ' ', text)
+    text = ''.join(ch if unicodedata.category(ch)[0] in 'LN' else ' ' for ch in text)
+    return ' '.join(text.split())
+
+
+def parse_date(value):
+    """date from YYYYMMDD (yt-dlp) or an ISO timestamp (Rutube created_ts), else None"""
+    if not value:
+        return None
+    value = str(value)
+    for fmt, size in (('%Y%m%d', 8), ('%Y-%m-%d', 10)):
+        try:
+            return datetime.datetime.strptime(value[:size], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def duration_bucket(duration):
+    return int(duration // DURATION_BUCKET) if duration else None
+
+
+def youtube_key(video):
+    """Comparable fields of a YouTube video dict (id, title, duration, upload_date)"""
+    return {
+        'id': video.get('id') or video.get('y_id'),
+        'title': video.get('title'),
+        'norm': normalize_title(video.get('title')),
+        'duration': video.get('duration'),
+        'date': parse_date(video.get('upload_date')),
+    }
+
+
+def rutube_key(row):
+    """Comparable fields of a rutube_catalog row (or a Rutube API video dict)"""
+    return {
+        'id': str(row.get('rutube_id') or row.get('id')),
+        'title': row.get('title'),
+        'norm': normalize_title(row.get('title')),
+        'duration': row.get('duration'),
+        'date': parse_date(row.get('created_ts')),
+    }
+
+
+def score(yt, rt):
+    """(confidence 0..1, {feature: score}) for one YouTube/Rutube pair of *_key() dicts"""
+    scores = {}
+    if yt['norm'] and rt['norm']:
+        if yt['norm'] == rt['norm']:
+            scores['title'] = 1.0
+        else:
+            matcher = difflib.SequenceMatcher(None, yt['norm'], rt['norm'])
+            scores['title'] = matcher.ratio() if matcher.quick_ratio() >= POSSIBLE else 0.0
+    if yt['duration'] and rt['duration']:
+        diff = abs(yt['duration'] - rt['duration'])
+        scores['duration'] = max(0.0, 1 - max(0.0, diff - 2) / 10)
+    if yt['date'] and rt['date']:
+        delta = (rt['date'] - yt['date']).days
+        scores['date'] = 1.0 if 0 <= delta <= DATE_WINDOW_DAYS else 0.0
+    if 'title' not in scores:
+        # Без названия совпадение длительности и даты ничего не доказывает
+        return 0.0, scores
+    return round(sum(w * scores.get(f, UNKNOWN) for f, w in WEIGHTS.items()), 6), scores
+
+
+class RutubeIndex:
+    def __init__(self, rows):
+        """
+        :param rows: Видео Rutube (строки rutube_catalog); удаленные и с ошибкой пропускаются
+        """
+        self.videos = {}
+        self.by_title = collections.defaultdict(list)
+        self.by_duration = collections.defaultdict(set)
+        self.by_date = collections.defaultdict(set)
+        for row in rows:
+            if row.get('status') in DEAD_STATUSES:
+                continue
+            key = rutube_key(row)
+            self.videos[key['id']] = key
+            if key['norm']:
+                self.by_title[key['norm']].append(key['id'])
+            bucket = duration_bucket(key['duration'])
+            if bucket is not None:
+                self.by_duration[bucket].add(key['id'])
+            if key['date']:
+                self.by_date[key['date']].add(key['id'])
+
+    def candidates(self, yt):
+        """Rutube IDs sharing the normalized title, or a close duration and a date in the window"""
+        found = set(self.by_title.get(yt['norm'], ()))
+        bucket = duration_bucket(yt['duration'])
+        if bucket is not None and yt['date']:
+            near = set()
+            for b in (bucket - 1, bucket, bucket + 1):
+                near |= self.by_duration.get(b, set())
+            if near:
+                days = set()
+                for d in range(DATE_WINDOW_DAYS + 1):
+                    days |= self.by_date.get(yt['date'] + datetime.timedelta(days=d), set())
+                found |= near & days
+        return found
+
+    def best(self, video, exclude=()):
+        """(rutube_id, confidence) of the best candidate for a YouTube video dict, or (None, 0.0)"""
+        yt = youtube_key(video)
+        best = (None, 0.0)
+        for rutube_id in self.candidates(yt) - set(exclude):
+            confidence, _ = score(yt, self.videos[rutube_id])
+            if confidence > best[1]:
+                best = (rutube_id, confidence)
+        return best
+
+    def exact(self, video, exclude=()):
+        """
+        rutube_id of a video with the same normalized title and the same
+        duration (both known), or None. Strict enough to act on without review.
+        """
+        yt = youtube_key(video)
+        if not yt['norm'] or not yt['duration']:
+            return None
+        for rutube_id in self.by_title.get(yt['norm'], ()):
+            rt = self.videos[rutube_id]
+            if rutube_id not in exclude and rt['duration'] and score(yt, rt)[1]['duration'] == 1.0:
+                return rutube_id
+        return None
+
+
+class Reconciler:
+    def __init__(self, store):
+        """
+        :param store: SyncStore (общее соединение с DB_FILE)
+        """
+        self.store = store
+        with store.transaction() as conn:
+            conn.execute(SCHEMA)
+            conn.execute('CREATE INDEX IF NOT EXISTS video_mappings_rutube ON video_mappings (rutube_id)')
+
+    def mappings(self):
+        """{y_id: rutube_id}"""
+        return dict(self.store.query('SELECT y_id, rutube_id FROM video_mappings'))
+
+    def record(self, y_id, rutube_id, confidence=1.0, method='upload'):
+        self.save([{'y_id': y_id, 'rutube_id': rutube_id, 'confidence': confidence}], method)
+
+    def forget(self, y_id, rutube_id):
+        """Drops the pair (the Rutube video never finished processing). Returns True if it existed."""
+        return self.store.execute('DELETE FROM video_mappings WHERE y_id = ? AND rutube_id = ?',
+                                  (y_id, str(rutube_id))).rowcount > 0
+
+    def save(self, matches, method='reconcile'):
+        """Stores matches ({'y_id', 'rutube_id', 'confidence'}). Returns how many were written."""
+        now = time.time()
+        with self.store.transaction() as conn:
+            for m in matches:
+                conn.execute(
+                    '''INSERT OR REPLACE INTO video_mappings (y_id, rutube_id, confidence, method, created_at)
+                       VALUES (?, ?, ?, ?, ?)''',
+                    (m['y_id'], str(m['rutube_id']), m['confidence'], method, now))
+        return len(matches)
+
+    def reconcile(self, youtube_videos, rutube_rows, confirm=CONFIRM, possible=POSSIBLE):
+        """
+        Matches both catalogs one-to-one. Pairs already in video_mappings are
+        kept as they are. Returns a report dict:
+            mapped     - [match] from video_mappings
+            matched    - [match] new pairs with confidence >= confirm
+            possible   - [match] best pairs between possible and confirm (check by hand)
+            unmatched_youtube / unmatched_rutube - leftover videos
+        where match = {'y_id', 'rutube_id', 'confidence', 'youtube_title', 'rutube_title', 'scores'}.
+        """
+        index = RutubeIndex(rutube_rows)
+        youtube = {}
+        for video in youtube_videos:
+            yt = youtube_key(video)
+            if yt['id']:
+                youtube[yt['id']] = yt
+
+        mapped = []
+        taken_y, taken_r = set(), set()
+        for y_id, rutube_id in self.mappings().items():
+            if y_id in youtube and rutube_id in index.videos:
+                mapped.append(self._match(youtube[y_id], index.videos[rutube_id], 1.0, {}))
+                taken_y.add(y_id)
+                taken_r.add(rutube_id)
+
+        pairs = []
+        for y_id, yt in youtube.items():
+            if y_id in taken_y:
+                continue
+            for rutube_id in index.candidates(yt) - taken_r:
+                confidence, scores = score(yt, index.videos[rutube_id])
+                if confidence >= possible:
+                    pairs.append((confidence, y_id, rutube_id, scores))
+
+        # Жадно от самых уверенных пар: каждое видео участвует не больше чем в одной
+        matched, maybe = [], []
+        for confidence, y_id, rutube_id, scores in sorted(pairs, key=lambda p: -p[0]):
+            if y_id in taken_y or rutube_id in taken_r:
+                continue
+            taken_y.add(y_id)
+            taken_r.add(rutube_id)
+            match = self._match(youtube[y_id], index.videos[rutube_id], confidence, scores)
+            (matched if confidence >= confirm else maybe).append(match)
+
+        return {
+            'mapped': mapped,
+            'matched': matched,
+            'possible': maybe,
+            'unmatched_youtube': [yt for y_id, yt in youtube.items() if y_id not in taken_y],
+            'unmatched_rutube': [rt for rutube_id, rt in index.videos.items() if rutube_id not in taken_r],
+        }
+
+    @staticmethod
+    def _match(yt, rt, confidence, scores):
+        return {
+            'y_id': yt['id'],
+            'rutube_id': rt['id'],
+            'confidence': round(confidence, 3),
+            'youtube_title': yt['title'],
+            'rutube_title': rt['title'],
+            'scores': scores,
+        }
+
+
+def youtube_videos_from_db(store):
+    """
+    YouTube side from the sync DB: every video published to Rutube, with the
+    title it was uploaded under, and duration / upload date from the metadata
+    cache where known.
+    """
+    # Таблицы кэша может еще не быть, если sync_production ни разу не запускался
+    store.execute(METADATA_SCHEMA)
+    rows = store.query(
+        '''SELECT p.y_id, COALESCE(p.title, m.title), m.duration, m.upload_date
+           FROM publications p LEFT JOIN video_metadata m ON m.y_id = p.y_id
+           WHERE p.rutube_status IS NOT NULL''')
+    return [{'id': y_id, 'title': title, 'duration': duration, 'upload_date': upload_date}
+            for y_id, title, duration, upload_date in rows]
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Local mirror of our own Rutube videos in the sync database.
+
+The account's video list is newest first, so a refresh reads pages only until
+one comes back whose videos are all already mirrored with the same title,
+status, visibility and duration - everything older is unchanged too. Videos
+removed on Rutube can't be noticed that way: a full pass is made when the
+last complete one is older than `full_interval` (or never finished), and it
+drops every row the pass didn't see. Tools query the mirror instead of paging the API.
+"""
+import time
+
+import requests
+
+from rutube_client import client_from_config
+from sync_store import SyncStore
+
+# Полный проход не реже раза в неделю (чтобы заметить удаленные видео)
+FULL_INTERVAL = 7 * 24 * 3600
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rutube_catalog (
+    rutube_id TEXT PRIMARY KEY,
+    title TEXT,
+    status TEXT,
+    is_hidden INTEGER,
+    created_ts TEXT,
+    duration REAL,
+    updated_at REAL NOT NULL,
+    seen_at REAL NOT NULL
+)
+'''
+
+STATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rutube_catalog_state (
+    user_id TEXT PRIMARY KEY,
+    full_refresh_at REAL
+)
+'''
+
+# Поля, изменение которых считается изменением видео
+TRACKED = ('title', 'status', 'is_hidden', 'duration')
+COLUMNS = ('rutube_id',) + TRACKED + ('created_ts', 'updated_at', 'seen_at')
+
+
+def project(video):
+    """Mirror row fields from a Rutube API video dict"""
+    status = video.get('status')
+    if isinstance(status, dict):
+        status = status.get('name') or status.get('id')
+    is_hidden = video.get('is_hidden')
+    return {
+        'rutube_id': str(video.get('id')),
+        'title': video.get('title'),
+        'status': status,
+        'is_hidden': None if is_hidden is None else int(bool(is_hidden)),
+        'duration': video.get('duration'),
+        'created_ts': video.get('created_ts'),
+    }
+
+
+class RutubeCatalog:
+    def __init__(self, store, client, full_interval=FULL_INTERVAL, log=print):
+        """
+        :param store: SyncStore (общее соединение с DB_FILE)
+        :param client: RutubeClient
+        """
+        self.store = store
+        self.client = client
+        self.full_interval = full_interval
+        self.log = log
+        with store.transaction() as conn:
+            conn.execute(SCHEMA)
+            conn.execute(STATE_SCHEMA)
+
+    def count(self):
+        return self.store.query('SELECT COUNT(*) FROM rutube_catalog')[0][0]
+
+    def last_full_refresh(self):
+        rows = self.store.query('SELECT full_refresh_at FROM rutube_catalog_state WHERE user_id = ?',
+                                (str(self.client.user_id()),))
+        return rows[0][0] if rows else None
+
+    def needs_full(self):
+        """True when no full pass has completed within full_interval"""
+        last = self.last_full_refresh()
+        return last is None or time.time() - last > self.full_interval
+
+    def upsert_page(self, videos, now=None):
+        """Stores one page. Returns the number of new or changed videos."""
+        now = now or time.time()
+        rows = [project(v) for v in videos if v.get('id') is not None]
+        changed = 0
+        with self.store.transaction() as conn:
+            for row in rows:
+                old = conn.execute(f'SELECT {", ".join(TRACKED)} FROM rutube_catalog WHERE rutube_id = ?',
+                                   (row['rutube_id'],)).fetchone()
+                if old is not None and tuple(old) == tuple(row[f] for f in TRACKED):
+                    conn.execute('UPDATE rutube_catalog SET seen_at = ? WHERE rutube_id = ?', (now, row['rutube_id']))
+                    continue
+                changed += 1
+                conn.execute(
+                    '''INSERT INTO rutube_catalog (rutube_id, title, status, is_hidden, created_ts, duration, updated_at, seen_at)
+                       VALUES (:rutube_id, :title, :status, :is_hidden, :created_ts, :duration, :now, :now)
+                       ON CONFLICT(rutube_id) DO UPDATE SET
+                           title = excluded.title, status = excluded.status, is_hidden = excluded.is_hidden,
+                           created_ts = COALESCE(excluded.created_ts, created_ts), duration = excluded.duration,
+                           updated_at = excluded.updated_at, seen_at = excluded.seen_at''',
+                    dict(row, now=now))
+        return changed
+
+    def refresh(self, full=None):
+        """
+        Brings the mirror up to date. full=None decides by needs_full().
+        Returns (new or changed videos, ok); on a failed page the rows read
+        so far are kept, but nothing is dropped.
+        """
+        started = time.time()
+        changed = pages = 0
+        try:
+            if full is None:
+                full = self.needs_full()
+            # Полный проход читает страницы параллельно, обновление - по одной до первой неизмененной
+            for page in self.client.list_pages(concurrent=full):
+                pages += 1
+                page_changed = self.upsert_page(page, started)
+                changed += page_changed
+                if not full and not page_changed:
+                    break
+        except requests.RequestException as e:
+            self.log(f"⚠️ Каталог Rutube обновлен не полностью (страниц: {pages}): {e}")
+            return changed, False
+
+        removed = 0
+        if full:
+            with self.store.transaction() as conn:
+                removed = conn.execute('DELETE FROM rutube_catalog WHERE seen_at < ?', (started,)).rowcount
+                conn.execute('INSERT OR REPLACE INTO rutube_catalog_state (user_id, full_refresh_at) VALUES (?, ?)',
+                             (str(self.client.user_id()), started))
+        self.log(f"🗂️ Каталог Rutube: {'полный проход' if full else 'обновление'}, страниц {pages}, "
+                 f"новых/измененных {changed}, удалено {removed}, всего {self.count()}")
+        return changed, True
+
+    def videos(self):
+        """Every mirrored video as a dict, newest first"""
+        rows = self.store.query(f'SELECT {", ".join(COLUMNS)} FROM rutube_catalog ORDER BY created_ts DESC')
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+
+def catalog_from_config(config, log=print):
+    """RutubeCatalog on config.DB_FILE with the client from client_from_config()"""
+    return RutubeCatalog(SyncStore(config.DB_FILE), client_from_config(config, log), log=log)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Shared Rutube API client for sync_production and the scripts in tools/.
+
+Grown out of archive/v2_experiments/rutube_uploader.RutubeUploader: one
+requests.Session with a pooled, retrying adapter (keep-alive instead of a TLS
+handshake per call) and the same timeouts for every request. The auth token
+is cached on disk and reused across runs until Rutube rejects it; only then
+does the client log in again.
+"""
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from paged_fetch import HostRateLimits, fetch_pages
+
+BASE_URL = "https://rutube.ru"
+TOKEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rutube_token.json")
+# (connect, read) в секундах
+TIMEOUT = (10, 30)
+RETRIES = 3
+POOL_SIZE = 10
+# Не больше стольких запросов в секунду на один хост (None - без ограничения)
+RATE_LIMIT = 5
+# Потоков для параллельного чтения страниц списков
+PAGE_WORKERS = 4
+# Ответы, после которых токен считаем недействительным
+AUTH_ERRORS = (401, 403)
+
+
+def make_session(retries=RETRIES, pool_size=POOL_SIZE):
+    """
+    Session with connection pooling. Idempotent requests are retried on
+    connection errors and 429/5xx; POST only when the connection failed.
+    """
+    retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=1,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(("GET", "HEAD", "OPTIONS")),
+                  respect_retry_after_header=True, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class RutubeClient:
+    def __init__(self, username, password, token_file=TOKEN_FILE, timeout=TIMEOUT,
+                 retries=RETRIES, pool_size=POOL_SIZE, rate_limit=RATE_LIMIT, page_workers=PAGE_WORKERS, log=print):
+        """
+        :param username: Email или телефон (логин)
+        :param token_file: Файл с сохраненным токеном (None - не сохранять)
+        :param timeout: Таймаут по умолчанию для всех запросов
+        :param rate_limit: Запросов в секунду на хост
+        :param page_workers: Потоков для list_pages(concurrent=True)
+        """
+        self.username = username
+        self.password = password
+        self.token_file = token_file
+        self.timeout = timeout
+        self.log = log
+        self.session = make_session(retries, max(pool_size, page_workers))
+        self.rate_limits = HostRateLimits(rate_limit)
+        self.page_workers = page_workers
+        self.token = None
+        self._user_id = None
+        self._lock = threading.Lock()
+
+    def load_token(self):
+        """Token saved by an earlier run for the same login, or None"""
+        if not self.token_file:
+            return None
+        try:
+            with open(self.token_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data.get('token') if data.get('username') == self.username else None
+
+    def save_token(self):
+        if not self.token_file:
+            return
+        tmp = self.token_file + ".tmp"
+        # Токен дает полный доступ к аккаунту: файл только для владельца
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({'username': self.username, 'token': self.token, 'created_at': time.time()}, f)
+        os.replace(tmp, self.token_file)
+
+    def auth(self):
+        """Logs in with the password (token_auth) and stores the token. Returns the token or None."""
+        try:
+            self.rate_limits.wait(BASE_URL)
+            r = self.session.post(f"{BASE_URL}/api/accounts/token_auth/",
+                                  data={'username': self.username, 'password': self.password}, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.log(f"⚠️ Ошибка получения токена Rutube: {e}")
+            return None
+        if r.status_code != 200:
+            self.log(f"❌ Ошибка авторизации Rutube. Код: {r.status_code}")
+            return None
+        self.token = r.json().get('token')
+        if self.token:
+            self.save_token()
+        return self.token
+
+    def get_token(self):
+        """Cached token (memory, then disk) or a fresh login"""
+        with self._lock:
+            if not self.token:
+                self.token = self.load_token()
+            if not self.token:
+                self.auth()
+            return self.token
+
+    def invalidate(self, token):
+        """Forgets a rejected token (unless another thread already replaced it)"""
+        with self._lock:
+            if self.token == token:
+                self.token = None
+                if self.token_file:
+                    try:
+                        os.remove(self.token_file)
+                    except FileNotFoundError:
+                        pass
+
+    def request(self, method, path, **kwargs):
+        """
+        Authorized request to BASE_URL + path (or a full URL, e.g. data['next']).
+        A rejected token is replaced by a fresh login and the request is sent once more.
+        Network errors are raised as requests.RequestException.
+        """
+        url = path if path.startswith("http") else BASE_URL + path
+        kwargs.setdefault('timeout', self.timeout)
+        headers = dict(kwargs.pop('headers', None) or {})
+        for attempt in range(2):
+            token = self.get_token()
+            if not token:
+                raise requests.RequestException("Rutube login failed")
+            headers['Authorization'] = f"Token {token}"
+            self.rate_limits.wait(url)
+            r = self.session.request(method, url, headers=headers, **kwargs)
+            if r.status_code not in AUTH_ERRORS or attempt:
+                return r
+            self.log(f"🔑 Токен Rutube отклонен ({r.status_code}), авторизуемся заново")
+            self.invalidate(token)
+        return r
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def user_id(self):
+        """ID of the logged-in account (cached)"""
+        if self._user_id is None:
+            for path in ("/api/profile/user/", "/api/accounts/profile/"):
+                r = self.get(path)
+                if r.status_code == 200:
+                    self._user_id = r.json().get('id')
+                    break
+        return self._user_id
+
+    def video(self, video_id):
+        """Video info dict or None"""
+        r = self.get(f"/api/video/{video_id}/")
+        return r.json() if r.status_code == 200 else None
+
+    def create_video(self, url, title, description="", category_id=13, is_hidden=False):
+        """POST /api/video/ (Rutube downloads the file from url). Returns the response."""
+        payload = {
+            "url": url,
+            "title": title,
+            "is_hidden": is_hidden,
+            "category_id": category_id,
+            "description": description,
+        }
+        return self.post("/api/video/", json=payload)
+
+    def list_pages(self, user_id=None, limit=50, concurrent=False):
+        """
+        Yields the account's video list one page (list of dicts) at a time,
+        newest first. Raises requests.RequestException if a page can't be read,
+        so a caller never mistakes a cut-off list for the whole catalog.
+        concurrent=True fetches the pages after the first in parallel
+        (for full reads; an incremental read that stops early should not).
+        """
+        user_id = user_id or self.user_id()
+        if not user_id:
+            raise requests.RequestException("Rutube user ID is unknown")
+        workers = self.page_workers if concurrent else 1
+        yield from fetch_pages(self.get, f"{BASE_URL}/api/video/person/{user_id}/?limit={limit}",
+                               workers, log=self.log)
+
+
+def client_from_config(config, log=print):
+    """RutubeClient with the login and optional RUTUBE_* settings from config.py"""
+    return RutubeClient(config.RUTUBE_LOGIN, config.RUTUBE_PASSWORD,
+                        getattr(config, "RUTUBE_TOKEN_FILE", TOKEN_FILE),
+                        rate_limit=getattr(config, "RUTUBE_RATE_LIMIT", RATE_LIMIT),
+                        page_workers=getattr(config, "RUTUBE_PAGE_WORKERS", PAGE_WORKERS), log=log)
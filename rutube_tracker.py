@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Background tracker for Rutube videos that are still being processed.
+
+After the POST to /api/video/ the video is recorded in rutube_pending and the
+pipeline moves on. One background thread polls every pending video through the
+shared RutubeClient session, each on its own exponential backoff, and calls the
+follow-ups (cover frame, releasing the local file) once Rutube reports the
+video ready or in moderation. The rows outlive the process: videos still
+processing when a run ends are picked up by the next run.
+"""
+import threading
+import time
+
+import requests
+
+# Первая проверка через FIRST_DELAY, дальше интервал удваивается до MAX_DELAY
+FIRST_DELAY = 5
+MAX_DELAY = 300
+# Видео, не обработанное за это время, перестаем отслеживать
+MAX_AGE = 24 * 3600
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rutube_pending (
+    rutube_id TEXT PRIMARY KEY,
+    y_id TEXT NOT NULL,
+    title TEXT,
+    description TEXT,
+    ingest TEXT,
+    checks INTEGER NOT NULL DEFAULT 0,
+    last_status TEXT,
+    next_check_at REAL NOT NULL,
+    created_at REAL NOT NULL
+)
+'''
+
+COLUMNS = ('rutube_id', 'y_id', 'title', 'description', 'ingest', 'checks', 'last_status', 'next_check_at', 'created_at')
+
+
+def processing_state(data):
+    """True when ready (or in moderation), False when Rutube gave up on it, None while processing"""
+    status = data.get('status')
+    action_reason = (data.get('action_reason') or {}).get('name')
+    if status == 'ready' or action_reason == 'moderation':
+        return True
+    if status == 'error' or (data.get('is_deleted') and action_reason != 'downloading_video'):
+        return False
+    return None
+
+
+class RutubeTracker:
+    def __init__(self, store, client, first_delay=FIRST_DELAY, max_delay=MAX_DELAY, max_age=MAX_AGE, log=print):
+        """
+        :param store: SyncStore (общее соединение с DB_FILE)
+        :param client: RutubeClient для всех проверок
+        """
+        self.store = store
+        self.client = client
+        self.first_delay = first_delay
+        self.max_delay = max_delay
+        self.max_age = max_age
+        self.log = log
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        with store.transaction() as conn:
+            conn.execute(SCHEMA)
+
+    def add(self, rutube_id, y_id, title=None, description=None, ingest=None):
+        """Starts tracking a freshly posted video"""
+        now = time.time()
+        self.store.execute(
+            '''INSERT OR REPLACE INTO rutube_pending
+               (rutube_id, y_id, title, description, ingest, checks, next_check_at, created_at)
+               VALUES (?, ?, ?, ?, ?, 0, ?, ?)''',
+            (str(rutube_id), y_id, title, description, ingest, now + self.first_delay, now))
+        self._wake.set()
+
+    def pending(self, due_only=False):
+        """Tracked videos as dicts, the ones to check first on top"""
+        sql = f'SELECT {", ".join(COLUMNS)} FROM rutube_pending'
+        params = ()
+        if due_only:
+            sql += ' WHERE next_check_at <= ?'
+            params = (time.time(),)
+        rows = self.store.query(sql + ' ORDER BY next_check_at', params)
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def count(self):
+        return self.store.query('SELECT COUNT(*) FROM rutube_pending')[0][0]
+
+    def forget(self, rutube_id):
+        self.store.execute('DELETE FROM rutube_pending WHERE rutube_id = ?', (str(rutube_id),))
+
+    def check(self, rutube_id):
+        """(processing_state(), Rutube status) of one video; state is None also on network/API errors"""
+        try:
+            r = self.client.get(f"/api/video/{rutube_id}/")
+        except requests.RequestException as e:
+            self.log(f"⚠️ Ошибка сети при проверке статуса {rutube_id}: {e}")
+            return None, None
+        if r.status_code != 200:
+            self.log(f"⚠️ Ошибка проверки статуса {rutube_id}: {r.status_code}")
+            return None, None
+        try:
+            data = r.json()
+        except ValueError:
+            return None, None
+        return processing_state(data), data.get('status')
+
+    def poll_once(self, on_ready, on_failed=None, on_expired=None):
+        """
+        Checks every video whose next check is due. on_ready(row) / on_failed(row) /
+        on_expired(row) (not processed within max_age) run in the calling thread;
+        the row is forgotten before they are called. Returns the number of videos checked.
+        """
+        rows = self.pending(due_only=True)
+        for row in rows:
+            if self._stop.is_set():
+                break
+            state, status = self.check(row['rutube_id'])
+            expired = state is None and time.time() - row['created_at'] > self.max_age
+            if state is None and not expired:
+                checks = row['checks'] + 1
+                delay = min(self.first_delay * 2 ** checks, self.max_delay)
+                self.store.execute(
+                    'UPDATE rutube_pending SET checks = ?, last_status = ?, next_check_at = ? WHERE rutube_id = ?',
+                    (checks, status or row['last_status'], time.time() + delay, row['rutube_id']))
+                continue
+
+            self.forget(row['rutube_id'])
+            try:
+                if expired:
+                    self.log(f"⏰ Rutube {row['rutube_id']} ({row['y_id']}) не обработано за "
+                             f"{self.max_age // 3600} ч, больше не отслеживаем")
+                    if on_expired:
+                        on_expired(row)
+                elif state:
+                    on_ready(row)
+                else:
+                    self.log(f"❌ Rutube {row['rutube_id']} ({row['y_id']}): статус {status}, обработка не удалась")
+                    if on_failed:
+                        on_failed(row)
+            except Exception as e:
+                self.log(f"⚠️ Ошибка после обработки {row['rutube_id']}: {e}")
+        return len(rows)
+
+    def next_due_in(self):
+        """Seconds until the nearest check, None when nothing is tracked"""
+        rows = self.store.query('SELECT MIN(next_check_at) FROM rutube_pending')
+        if rows[0][0] is None:
+            return None
+        return max(0.0, rows[0][0] - time.time())
+
+    def start(self, on_ready, on_failed=None, on_expired=None):
+        """Polls in a background thread until stop()"""
+        if self._thread:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                self._wake.clear()
+                self.poll_once(on_ready, on_failed, on_expired)
+                wait = self.next_due_in()
+                self._wake.wait(self.max_delay if wait is None else min(wait, self.max_delay))
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name="rutube-tracker", daemon=True)
+        self._thread.start()
+
+    def drain(self, timeout):
+        """Waits up to `timeout` seconds for the tracked videos to finish. Returns how many are left."""
+        deadline = time.time() + timeout
+        while self.count() and time.time() < deadline:
+            time.sleep(min(1.0, max(0.0, deadline - time.time())))
+        return self.count()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
@@ -2,14 +2,27 @@
 import os
 import sys
 import requests
-import subprocess
 import time
 import datetime
-import json
-import sqlite3
 import shutil
 import config
 import atexit
+import external_hosts
+
+from channel_scanner import ChannelScanner, merge_entries
+from download_manager import DownloadManager, sha256_file
+from health_stats import HealthStats
+from job_queue import JobQueue
+from media_cache import MediaCache
+from metadata_store import MetadataStore, IMMUTABLE_FIELDS, DEFAULT_MAX_ENTRIES
+from pipeline import Pipeline, Stage
+from reconcile import POSSIBLE, Reconciler, RutubeIndex
+from rutube_catalog import RutubeCatalog
+from rutube_client import client_from_config
+from rutube_tracker import RutubeTracker
+from sync_store import SyncStore
+from ytdlp_client import BandwidthBudget, YtDlpClient
+from youtube_feed import FeedChecker, feed_url_for
 
 # Import social uploader
 try:
@@ -34,11 +47,19 @@ PASSWORD = config.RUTUBE_PASSWORD
 PUBLIC_DOMAIN = config.PUBLIC_IP
 PORT = config.SERVER_PORT
 YOUTUBE_CHANNEL_URL = config.YOUTUBE_CHANNEL_URL
+# Atom-лента канала для быстрой проверки новых видео (None = только yt-dlp)
+YOUTUBE_FEED_URL = getattr(config, "YOUTUBE_FEED_URL", None) or feed_url_for(YOUTUBE_CHANNEL_URL)
 UPLOADS_DIR = config.UPLOADS_DIR
 DB_FILE = config.DB_FILE
 
-# Metadata cache file for quick lookups
+# Платформы, на которые публикуется каждое видео
+PLATFORMS = ('rutube', 'tiktok')
+
+# Old JSON metadata cache, imported into the DB once (see metadata_store.py)
 METADATA_CACHE_FILE = "video_metadata_cache.json"
+# TTL по классам полей, например {"mutable": 6 * 3600}; и лимит записей кэша
+METADATA_TTL = getattr(config, "METADATA_TTL", None)
+METADATA_CACHE_MAX_ENTRIES = getattr(config, "METADATA_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
 
 # Resolve yt-dlp path
 YT_DLP_PATH = config.YT_DLP_PATH
@@ -51,6 +72,18 @@ if not os.path.exists(YT_DLP_PATH) or not os.access(YT_DLP_PATH, os.X_OK):
     else:
         print("❌ CRITICAL: No yt-dlp found!")
 
+# yt-dlp: "auto" - Python-модуль, если установлен, иначе бинарник YT_DLP_PATH
+YTDLP_MODE = getattr(config, "YTDLP_MODE", "auto")
+# "native" (yt-dlp), "aria2c" или "auto" (aria2c, если установлен); соединений на одно скачивание.
+# Обычный формат - один progressive-файл: несколько соединений на него дает только aria2c
+DOWNLOAD_ENGINE = getattr(config, "DOWNLOAD_ENGINE", "auto")
+DOWNLOAD_CONNECTIONS = getattr(config, "DOWNLOAD_CONNECTIONS", 4)
+# Общий лимит скорости всех скачиваний в байтах/сек (None = без лимита),
+# чтобы server_simple.py успевал отдавать файлы Rutube
+DOWNLOAD_BANDWIDTH_LIMIT = getattr(config, "DOWNLOAD_BANDWIDTH_LIMIT", None)
+ytdlp = None
+client_stats = None
+
 # --- COOKIE HANDLING ---
 COOKIE_FILE = None
 TEMP_COOKIE_FILE = "youtube_cookies_runtime.txt"
@@ -88,94 +121,46 @@ def cleanup_cookies():
 def log(msg):
     print(f"[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}")
 
+# Общее соединение с DB_FILE (создается в init_db())
+store = None
+
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    conn.execute('CREATE TABLE IF NOT EXISTS synced (y_id TEXT PRIMARY KEY, title TEXT)')
-    conn.execute('CREATE TABLE IF NOT EXISTS publications (y_id TEXT PRIMARY KEY, title TEXT, description TEXT, rutube_status TEXT, tiktok_status TEXT, insta_status TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
-    conn.commit()
-    conn.close()
+    global store
+    if store is None:
+        store = SyncStore(DB_FILE)
+        atexit.register(store.close)
+    return store
 
 def is_video_synced(y_id, platform='rutube'):
-    conn = sqlite3.connect(DB_FILE)
-    column = f"{platform}_status"
-    cursor = conn.execute(f'SELECT 1 FROM publications WHERE y_id=? AND {column} IS NOT NULL', (y_id,))
-    exists = cursor.fetchone()
-    conn.close()
-    return exists is not None
+    return init_db().is_synced(y_id, platform)
+
+def get_sync_statuses(y_ids):
+    """Sync status of all IDs for all platforms in one query: {y_id: {platform: bool}}"""
+    return init_db().get_statuses(y_ids, PLATFORMS)
 
 def mark_video_synced(y_id, title, platform='rutube', description=None):
-    conn = sqlite3.connect(DB_FILE)
-    column = f"{platform}_status"
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    # Сначала проверяем, есть ли запись
-    cursor = conn.execute('SELECT 1 FROM publications WHERE y_id=?', (y_id,))
-    if cursor.fetchone():
-        if description:
-            conn.execute(f'UPDATE publications SET title=?, description=?, {column}=? WHERE y_id=?', 
-                        (title, description, now, y_id))
-        else:
-            conn.execute(f'UPDATE publications SET title=?, {column}=? WHERE y_id=?', 
-                        (title, now, y_id))
-    else:
-        conn.execute(f'INSERT INTO publications (y_id, title, description, {column}) VALUES (?, ?, ?, ?)', 
-                    (y_id, title, description, now))
-    
-    conn.commit()
-    conn.close()
+    init_db().mark_synced(y_id, title, platform, description)
 
 def load_metadata_cache():
-    """Load cached video metadata to avoid repeated API calls"""
-    if os.path.exists(METADATA_CACHE_FILE):
-        try:
-            with open(METADATA_CACHE_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            pass
-    return {}
-
-def save_metadata_cache(cache):
-    """Save video metadata cache"""
-    try:
-        with open(METADATA_CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        log(f"⚠️ Ошибка сохранения кэша: {e}")
+    """Opens the metadata cache table, migrating the old JSON file on first run"""
+    metadata_cache = MetadataStore(init_db(), METADATA_TTL, METADATA_CACHE_MAX_ENTRIES)
+    imported = metadata_cache.import_json_cache(METADATA_CACHE_FILE)
+    if imported:
+        log(f"📦 Кэш метаданных перенесен из {METADATA_CACHE_FILE} в БД ({imported} видео)")
+    return metadata_cache
+
+# Клиент Rutube API (создается в get_rutube_client())
+rutube_client = None
+
+def get_rutube_client():
+    global rutube_client
+    if rutube_client is None:
+        rutube_client = client_from_config(config, log)
+    return rutube_client
 
 def get_auth_token():
-    try:
-        r = requests.post("https://rutube.ru/api/accounts/token_auth/", data={'username': LOGIN, 'password': PASSWORD}, timeout=20)
-        return r.json().get('token') if r.status_code == 200 else None
-    except Exception as e:
-        log(f"⚠️ Ошибка получения токена Rutube: {e}")
-        return None
-
-def wait_for_processing(video_id, token, max_retries=120, delay=5):
-    headers = {"Authorization": f"Token {token}"}
-    for i in range(max_retries):
-        try:
-            r = requests.get(f"https://rutube.ru/api/video/{video_id}/", headers=headers)
-            if r.status_code == 200:
-                data = r.json()
-                status = data.get('status')
-                action_reason = data.get('action_reason', {}).get('name')
-                is_deleted = data.get('is_deleted')
-
-                if status == 'ready' or action_reason == 'moderation':
-                    return True
-                
-                if status == 'error' or (is_deleted and action_reason != 'downloading_video'):
-                    log(f"❌ Видео перешло в статус {status} или удалено (reason: {action_reason})")
-                    return False
-            else:
-                log(f"⚠️ Ошибка проверки статуса: {r.status_code}")
-        except Exception as e:
-            log(f"⚠️ Ошибка сети при проверке статуса: {e}")
-        
-        time.sleep(delay)
-    
-    log("⏰ Превышено время ожидания обработки видео")
-    return False
+    """Token saved by an earlier run, or a fresh login"""
+    return get_rutube_client().get_token()
 
 def get_python_executable():
     """Returns path to the current or venv python executable"""
@@ -184,340 +169,774 @@ def get_python_executable():
         return venv_python
     return sys.executable
 
+def get_ytdlp():
+    """yt-dlp client shared by scan, metadata and download calls within a run"""
+    global ytdlp
+    if ytdlp is None:
+        ytdlp = YtDlpClient(YT_DLP_PATH, COOKIE_FILE, mode=YTDLP_MODE,
+                            download_engine=DOWNLOAD_ENGINE, download_connections=DOWNLOAD_CONNECTIONS,
+                            bandwidth=BandwidthBudget(DOWNLOAD_BANDWIDTH_LIMIT))
+        log(f"🧩 yt-dlp mode: {ytdlp.mode}, download engine: {ytdlp.download_engine} x{DOWNLOAD_CONNECTIONS}")
+    return ytdlp
+
+# Пытаемся разные комбинации клиентов для обхода блокировок
+METADATA_CLIENTS = [
+    "web,ios,android", # Стандартный набор с имитацией браузера
+    "tv,web_embedded", # ТВ-клиенты (часто обходят "Sign in to confirm")
+    "android",         # Чистый андроид
+    "ios"              # Чистый iOS
+]
+
+def get_client_stats():
+    """Per-client success rate and latency for METADATA_CLIENTS, kept in the DB"""
+    global client_stats
+    if client_stats is None:
+        client_stats = HealthStats(init_db(), "ytdlp_client")
+    return client_stats
+
 def get_full_video_info(y_id, metadata_cache=None):
     """Fetches full video metadata with aggressive bypass methods"""
     
-    if metadata_cache and y_id in metadata_cache:
-        log(f"📄 Метадата видео {y_id} найдена в кэше")
-        return metadata_cache[y_id]
+    if metadata_cache is not None:
+        cached = metadata_cache.get(y_id)
+        if cached:
+            log(f"📄 Метадата видео {y_id} найдена в кэше")
+            return cached
     
-    # Пытаемся разные комбинации клиентов для обхода блокировок
-    clients = [
-        "web,ios,android", # Стандартный набор с имитацией браузера
-        "tv,web_embedded", # ТВ-клиенты (часто обходят "Sign in to confirm")
-        "android",         # Чистый андроид
-        "ios"              # Чистый iOS
-    ]
+    # Сначала клиенты, которые в последнее время срабатывали чаще и быстрее
+    for attempt, client_list in enumerate(get_client_stats().order(METADATA_CLIENTS)):
+        if COOKIE_FILE:
+            log(f"🍮 Attempt {attempt + 1}: Using cookies + clients ({client_list})")
+        else:
+            log(f"⚠️ Attempt {attempt + 1}: No cookies, trying clients ({client_list})")
 
-    for attempt, client_list in enumerate(clients):
+        started = time.time()
         try:
-            cmd = [
-                YT_DLP_PATH, 
-                "--dump-json",
-                "--no-check-certificates",
-                "--extractor-args", f"youtube:player_client={client_list};player_skip=webpage,configs",
-                "--js-runtimes", "deno",
-                "--user-agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
-            ]
-            
-            if COOKIE_FILE:
-                cmd.extend(["--cookies", COOKIE_FILE])
-                log(f"🍮 Attempt {attempt + 1}: Using cookies + clients ({client_list})")
-            else:
-                log(f"⚠️ Attempt {attempt + 1}: No cookies, trying clients ({client_list})")
-            
-            cmd.append(f"https://youtube.com/watch?v={y_id}")
-            
-            res = subprocess.run(cmd, capture_output=True, text=True, timeout=45)
-            
-            if res.returncode == 0:
-                data = json.loads(res.stdout)
-                if metadata_cache is not None:
-                    metadata_cache[y_id] = data
-                log(f"✅ Success with client {client_list}")
-                return data
-            
-            # Логируем конкретную ошибку для каждого метода
-            error_msg = res.stderr.split('\n')[0] if res.stderr else "Unknown error"
-            log(f"⚠️ Client {client_list} failed: {error_msg}")
-            
+            data, error_msg = get_ytdlp().extract_video(y_id, client_list, timeout=45)
         except Exception as e:
             log(f"⚠️ Error during metadata fetch: {e}")
+            continue
+        get_client_stats().record(client_list, bool(data), time.time() - started)
+
+        if data:
+            if metadata_cache is not None:
+                data = metadata_cache.put(y_id, data)
+            log(f"✅ Success with client {client_list}")
+            return data
+
+        # Логируем конкретную ошибку для каждого метода
+        log(f"⚠️ Client {client_list} failed: {error_msg}")
     
     log(f"❌ All bypass methods failed for {y_id}")
     return None
 
-def process_video(y_id, title, description, token):
-    log(f"🚀 Обработка: {title}")
-    local_file_base = os.path.join(UPLOADS_DIR, y_id)
-    local_video_path = f"{local_file_base}.mp4"
-    
-    if not os.path.exists(local_video_path):
+def prefetch_video_info(y_ids, metadata_cache):
+    """
+    Resolves metadata for many videos in one extractor session and stores it
+    in the cache, so the metadata stage only has cache hits. IDs that fail
+    here go through the full per-video client chain in the metadata stage.
+    Returns {y_id: error} for the failed IDs.
+    """
+    # Проверка без учета в статистике: попаданием считается только чтение на этапе метаданных
+    missing = [y_id for y_id in y_ids if not metadata_cache.has_fresh(y_id)]
+    if not missing:
+        return {}
+
+    client_list = get_client_stats().order(METADATA_CLIENTS)[0]
+    log(f"📚 Пакетная загрузка метаданных: {len(missing)} видео (clients: {client_list})")
+    results, failures = get_ytdlp().extract_videos(missing, client_list,
+                                                   timeout=45, workers=METADATA_BATCH_WORKERS)
+    # Задержку по пакету не считаем - она не сравнима с одиночными запросами
+    for y_id in missing:
+        get_client_stats().record(client_list, y_id in results)
+    for y_id, info in results.items():
+        metadata_cache.put(y_id, info)
+    log(f"📚 Метаданные: получено {len(results)}, ошибок {len(failures)}")
+    for y_id, error in failures.items():
+        log(f"⚠️ {y_id}: {error}")
+    return failures
+
+# --- PIPELINE ---
+# Количество потоков и размер очередей для каждой стадии пайплайна.
+# Можно переопределить в config.py: PIPELINE_WORKERS = {"download": 3}
+PIPELINE_WORKERS = {
+    "metadata": 2,
+    "download": 2,
+    "external_upload": 2,
+    "publish": 1,
+    # TikTok: общий файл tiktok_posted.json и один Chrome на cookie-файл - строго по одному
+    "post_processing": 1,
+}
+PIPELINE_WORKERS.update(getattr(config, "PIPELINE_WORKERS", {}))
+PIPELINE_QUEUE_SIZE = getattr(config, "PIPELINE_QUEUE_SIZE", 2)
+
+# Лимиты за один запуск (на Rutube - 1 за раз, больше можно разрешить в config.py)
+MAX_RUTUBE_UPLOADS_PER_RUN = getattr(config, "MAX_RUTUBE_UPLOADS_PER_RUN", 1)
+MAX_SOCIAL_UPLOADS_PER_RUN = getattr(config, "MAX_SOCIAL_UPLOADS_PER_RUN", 3)
+
+# Пакетная загрузка метаданных для видео из очереди
+METADATA_PREFETCH_LIMIT = getattr(config, "METADATA_PREFETCH_LIMIT", 50)
+METADATA_BATCH_WORKERS = getattr(config, "METADATA_BATCH_WORKERS", 4)
+
+# Сканирование канала: страница для поиска новых видео и страница backfill
+SCAN_PAGE_SIZE = getattr(config, "SCAN_PAGE_SIZE", 5)
+BACKFILL_PAGE_SIZE = getattr(config, "BACKFILL_PAGE_SIZE", 50)
+# Страница старых видео - не чаще раза в столько секунд, даже если очередь пуста
+BACKFILL_PAGE_INTERVAL = getattr(config, "BACKFILL_PAGE_INTERVAL", 6 * 3600)
+# Плейлисты сканируются параллельно (None = поток на каждый плейлист)
+SCAN_WORKERS = getattr(config, "SCAN_WORKERS", None)
+channel_scanner = None
+
+# Общий с insta_tok кэш скачанных видео (ключ: YouTube ID + формат)
+MEDIA_CACHE_DIR = getattr(config, "MEDIA_CACHE_DIR", UPLOADS_DIR)
+MEDIA_CACHE_MAX_AGE = getattr(config, "MEDIA_CACHE_MAX_AGE", 7 * 24 * 3600)
+# Другие пайплайны, читающие тот же кэш: при скачивании файл резервируется и для них,
+# иначе его удалит последняя платформа здесь, и insta_tok скачает видео снова.
+# Ссылки, которые никто не освободил, снимает prune() через MEDIA_CACHE_MAX_AGE
+MEDIA_CONSUMERS = tuple(getattr(config, "MEDIA_CONSUMERS", ("insta_tok",)))
+media_cache = None
+
+# Как Rutube получает видео: "local" (скачать, залить на Catbox и отдать ссылку)
+# или "direct" (сначала прямая ссылка googlevideo, при отказе - как "local")
+RUTUBE_INGEST = getattr(config, "RUTUBE_INGEST", "local")
+
+# Докачка и проверка файлов (размер, sha256, ffprobe)
+DOWNLOAD_ATTEMPTS = getattr(config, "DOWNLOAD_ATTEMPTS", 3)
+FFPROBE_PATH = getattr(config, "FFPROBE_PATH", "ffprobe")
+download_manager = None
+# Ссылки на уже загруженные на внешние хосты файлы (по sha256)
+url_cache = None
+
+# Внешние хосты для файлов (порядок выбирается по статистике), локальный сервер - последний резерв
+EXTERNAL_HOSTS = getattr(config, "EXTERNAL_HOSTS", ["catbox", "litterbox"])
+LOCAL_SERVER = external_hosts.LocalServerHost(f"https://{PUBLIC_DOMAIN}/rutube-webhook/static/{{filename}}")
+external_host_stats = None
+# Скачивание с YouTube и загрузка на внешний хост одновременно (yt-dlp -o - через pipe)
+TEE_UPLOAD = getattr(config, "TEE_UPLOAD", False)
+
+# Очередь задач (создается в sync())
+job_queue = None
+
+# Сколько секунд в конце запуска ждать обработки отправленных видео (остальные проверит следующий запуск)
+RUTUBE_PROCESSING_WAIT = getattr(config, "RUTUBE_PROCESSING_WAIT", 600)
+rutube_tracker = None
+
+# Перед скачиванием ищем видео в зеркале каталога Rutube (защита от дублей)
+RUTUBE_DEDUPE = getattr(config, "RUTUBE_DEDUPE", True)
+reconciler = None
+rutube_index = None
+
+def finish_job(y_id, platform):
+    if job_queue:
+        job_queue.complete(y_id, platform)
+        job_queue.clear_failures(y_id)
+
+def describe_item(item):
+    return f"{item['y_id']} ({item.get('title') or '?'})"
+
+def get_media_cache():
+    global media_cache
+    if media_cache is None:
+        media_cache = MediaCache(MEDIA_CACHE_DIR)
+        atexit.register(media_cache.close)
+    return media_cache
+
+def get_download_manager():
+    global download_manager
+    if download_manager is None:
+        download_manager = DownloadManager(get_ytdlp(), get_media_cache(), DOWNLOAD_ATTEMPTS, FFPROBE_PATH, log)
+    return download_manager
+
+def download_video(y_id, consumers=PLATFORMS, tee=None):
+    """
+    Returns (local path, None) of the video from the shared media cache
+    (downloading or resuming it on a miss) or (None, error). Takes a cache reference
+    per consumer and per MEDIA_CONSUMERS entry.
+    tee: consumer(chunks) that receives the bytes while they are downloaded
+    (used only for a fresh download, a partial file is resumed instead).
+    """
+    manager = get_download_manager()
+
+    def download(y_id, path, format):
+        if tee and not os.path.exists(path + ".part"):
+            log(f"🔀 Скачивание {y_id} с одновременной загрузкой на внешний хост...")
+            ok, error, _ = manager.tee(y_id, path, format, tee)
+            if ok:
+                return ok, error
         # Используем самый надежный набор для скачивания
-        yt_cmd = [
-            YT_DLP_PATH, 
-            "-f", "best[ext=mp4]/best", 
-            "-o", f"{local_file_base}.%(ext)s",
-            "--no-check-certificates",
-            "--extractor-args", "youtube:player_client=tv,ios,android;player_skip=webpage,configs",
-            "--js-runtimes", "deno",
-            "--user-agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
-            "--retries", "3"
-        ]
-        
-        if COOKIE_FILE:
-            yt_cmd.extend(["--cookies", COOKIE_FILE])
-        
-        yt_cmd.append(f"https://youtube.com/watch?v={y_id}")
-        
-        log(f"😁 Скачивание через усиленные API (tv,ios,android)...")
-        result = subprocess.run(yt_cmd)
-
-    if not os.path.exists(local_video_path) or os.path.getsize(local_video_path) == 0:
-        log(f"❌ Ошибка: Видео не скачалось даже через мобильные API.")
+        log(f"😁 Скачивание {y_id} через усиленные API (tv,ios,android)...")
+        return manager.download(y_id, path, format)
+
+    consumers = list(dict.fromkeys([*consumers, *MEDIA_CONSUMERS]))
+    local_video_path, error = get_media_cache().acquire(y_id, consumers, download, validate=manager.validate)
+    if not local_video_path:
+        if error:
+            log(f"⚠️ yt-dlp: {error}")
+        log(f"❌ Ошибка: Видео {y_id} не скачалось даже через мобильные API.")
+        return None, error or "download failed"
+    return local_video_path, None
+
+def release_video(y_id, platform):
+    """Platform is done with the file; the cache deletes it after the last consumer"""
+    if get_media_cache().release(y_id, platform):
+        log(f"🗑️ Удален локальный файл {y_id} (все платформы готовы)")
+
+def get_external_host_stats():
+    """Per-host success rate and upload time for EXTERNAL_HOSTS, kept in the DB"""
+    global external_host_stats
+    if external_host_stats is None:
+        external_host_stats = HealthStats(init_db(), "external_host")
+    return external_host_stats
+
+def get_external_hosts():
+    """Configured external hosts, best recent success rate / speed first"""
+    hosts = {name: external_hosts.HOSTS[name]() for name in EXTERNAL_HOSTS}
+    return [hosts[name] for name in get_external_host_stats().order(list(hosts))]
+
+def upload_external(local_path, sha256):
+    """Uploads to the healthiest host that works. Returns (url, host name) or (None, None)."""
+    size = os.path.getsize(local_path)
+    for host in get_external_hosts():
+        log(f"📦 Uploading to {host.name} (External Host)...")
+        started = time.time()
+        video_url = host.upload(local_path, log)
+        # Задержка в секундах на MB, чтобы большие файлы не портили оценку хоста
+        get_external_host_stats().record(host.name, bool(video_url), (time.time() - started) / max(size / 1e6, 1))
+        if video_url:
+            if host.cacheable:
+                get_url_cache().put(sha256, host.name, video_url, size)
+            return video_url, host.name
+    return None, None
+
+def stage_metadata(item, metadata_cache):
+    y_id = item['y_id']
+    vid = item['vid']
+
+    # Если Рутуб уже готов, а ТикТок еще нет - проверяем ориентацию ДО того как считать это "работой".
+    # Размеры не меняются, поэтому хватает даже устаревшей записи кэша.
+    if not item['needs_rutube'] and item['needs_tiktok']:
+        dims = metadata_cache.get(y_id, IMMUTABLE_FIELDS) or get_full_video_info(y_id, metadata_cache)
+        width = (dims or {}).get('width') or 0
+        height = (dims or {}).get('height') or 0
+        if width > height and width > 0:
+            mark_video_synced(y_id, vid.get('title'), 'tiktok', vid.get('description'))
+            finish_job(y_id, 'tiktok')
+            release_video(y_id, 'tiktok')
+            return None
+
+    full_info = get_full_video_info(y_id, metadata_cache)
+
+    # Горизонтальные видео в TikTok не идут: отмечаем сразу, чтобы не держать
+    # под них локальный файл (и чтобы Rutube мог взять прямую ссылку)
+    if item['needs_tiktok'] and full_info:
+        width, height = full_info.get('width') or 0, full_info.get('height') or 0
+        if width > height and width > 0:
+            mark_video_synced(y_id, vid.get('title'), 'tiktok', vid.get('description'))
+            finish_job(y_id, 'tiktok')
+            release_video(y_id, 'tiktok')
+            item['jobs'].discard('tiktok')
+            item['needs_tiktok'] = False
+
+    if item['needs_rutube'] and find_on_rutube(item, full_info):
+        item['jobs'].discard('rutube')
+        item['needs_rutube'] = False
+        if not item['needs_tiktok']:
+            return None
+
+    log(f"🔎 Видео {y_id} требует внимания: Rutube={item['needs_rutube']}, TikTok={item['needs_tiktok']}")
+
+    if full_info:
+        item['title'] = full_info.get('title', vid.get('title'))
+        item['description'] = full_info.get('description', vid.get('description', ''))
+    else:
+        item['title'] = vid.get('title')
+        item['description'] = vid.get('description', '')
+    return item
+
+def get_reconciler():
+    global reconciler
+    if reconciler is None:
+        reconciler = Reconciler(init_db())
+    return reconciler
+
+def load_rutube_index():
+    """Refreshes the Rutube catalog mirror and indexes it for find_on_rutube()"""
+    global rutube_index
+    catalog = RutubeCatalog(init_db(), get_rutube_client(), log=log)
+    catalog.refresh()
+    rutube_index = RutubeIndex(catalog.videos())
+
+def find_on_rutube(item, full_info):
+    """
+    True if the video is already on Rutube: mapped to a video that still
+    exists, or with exactly the same normalized title and duration. It is then
+    marked synced and mapped instead of being uploaded again. Fuzzy matches
+    (edited titles, other episodes of a series) are only logged - they are
+    for tools/find_missing_uploads.py to report, not for skipping an upload.
+    """
+    if rutube_index is None:
         return False
+    y_id, vid = item['y_id'], item['vid']
+    video = {**vid, **{k: v for k, v in (full_info or {}).items() if v}, 'id': y_id}
+    mapped = get_reconciler().mappings()
+    if mapped.get(y_id) in rutube_index.videos:
+        rutube_id = mapped[y_id]
+    else:
+        # Привязки к удаленному с Rutube видео не считаем, ищем заново
+        rutube_id = rutube_index.exact(video, exclude=set(mapped.values()))
+        if rutube_id is None:
+            possible_id, confidence = rutube_index.best(video, exclude=set(mapped.values()))
+            if confidence >= POSSIBLE:
+                log(f"🔍 {y_id} похоже на Rutube {possible_id} (уверенность {confidence:.2f}), "
+                    f"но без точного совпадения загружаем")
+            return False
+        get_reconciler().record(y_id, rutube_id, 1.0, 'dedupe')
+    log(f"♻️ {y_id} уже есть на Rutube (ID: {rutube_id}), не загружаем повторно")
+    mark_video_synced(y_id, video.get('title'), 'rutube', video.get('description'))
+    finish_job(y_id, 'rutube')
+    release_video(y_id, 'rutube')
+    return True
 
-    # --- EXTERNAL UPLOAD (Catbox) ---
-    def upload_to_catbox(path):
-        log(f"📦 Uploading to Catbox (External Host)...")
-        try:
-            files = {'reqtype': (None, 'fileupload'), 'fileToUpload': open(path, 'rb')}
-            resp = requests.post("https://catbox.moe/user/api.php", files=files, timeout=300)
-            if resp.status_code == 200:
-                return resp.text.strip()
-            log(f"❌ Catbox Error: {resp.text}")
-        except Exception as e:
-            log(f"❌ Catbox Exception: {e}")
-        return None
+def stage_download(item):
+    log(f"🚀 Обработка: {item['title']}")
+
+    # Только Rutube: пробуем отдать ему прямую ссылку без локального скачивания
+    if RUTUBE_INGEST == "direct" and item['jobs'] == {'rutube'}:
+        direct_url, error = get_ytdlp().direct_url(item['y_id'])
+        if direct_url:
+            log("🔗 Прямая ссылка получена, Rutube заберет видео сам")
+            item['video_url'] = direct_url
+            item['ingest'] = 'direct'
+            return item
+        log(f"⚠️ Прямая ссылка недоступна ({error}), скачиваем локально")
+
+    tee = streaming_upload(item) if TEE_UPLOAD and item['needs_rutube'] else None
+    local_video_path, error = download_video(item['y_id'], item['jobs'], tee)
+    if not local_video_path:
+        item['error'] = error
+        return False
+    item['local_path'] = local_video_path
+    if item.get('video_host') and external_hosts.HOSTS[item['video_host']].cacheable:
+        # Ссылку из потоковой загрузки тоже запоминаем по хэшу файла
+        get_url_cache().put(file_hash(item['y_id'], local_video_path), item['video_host'],
+                            item['video_url'], os.path.getsize(local_video_path))
+    return item
+
+def streaming_upload(item):
+    """
+    DownloadManager.tee consumer: uploads to the healthiest external host
+    while the file is downloading, sets item['video_url'] on success
+    """
+    def consumer(chunks):
+        host = get_external_hosts()[0]
+        video_url = host.upload_stream(chunks, f"{item['y_id']}.mp4", log=log)
+        get_external_host_stats().record(host.name, bool(video_url))
+        if video_url:
+            log(f"✅ External URL ({host.name}, поток): {video_url}")
+            item['video_url'] = video_url
+            item['video_host'] = host.name
+        return video_url
+    return consumer
+
+def get_url_cache():
+    global url_cache
+    if url_cache is None:
+        url_cache = external_hosts.UrlCache(init_db())
+    return url_cache
+
+def file_hash(y_id, local_path):
+    """SHA-256 recorded by the download manager, or computed from the file"""
+    record = get_media_cache().integrity(y_id)
+    if record and record['expected_size'] == os.path.getsize(local_path):
+        return record['sha256']
+    return sha256_file(local_path)
+
+def external_video_url(y_id, local_path):
+    """
+    Public URL of a local file: a live URL from an earlier upload of the same
+    file, a new Catbox upload, or the local server as a fallback
+    """
+    sha256 = file_hash(y_id, local_path)
+    for name in EXTERNAL_HOSTS:
+        if not external_hosts.HOSTS[name].cacheable:
+            continue
+        video_url = get_url_cache().get(sha256, name)
+        if video_url:
+            log(f"♻️ Файл уже загружен на {name}: {video_url}")
+            return video_url
+
+    video_url, host_name = upload_external(local_path, sha256)
 
-    # Try external upload first
-    video_url = upload_to_catbox(local_video_path)
-    
     # Fallback to local server if external fails
     if not video_url:
         log("⚠️ External upload failed. Falling back to Local Server URL.")
-        video_url = f"https://{PUBLIC_DOMAIN}/rutube-webhook/static/{y_id}.mp4"
-    else:
-        log(f"✅ External URL: {video_url}")
-    # --------------------------------
+        return LOCAL_SERVER.upload(local_path, log)
+    log(f"✅ External URL ({host_name}): {video_url}")
+    return video_url
+
+def stage_external_upload(item):
+    if not item['needs_rutube'] or item.get('video_url'):
+        return item
+    item['video_url'] = external_video_url(item['y_id'], item['local_path'])
+    return item
+
+def ingest_locally(item):
+    """Fallback from a direct URL: download + Catbox, replaces item['video_url']"""
+    local_video_path, error = download_video(item['y_id'], item['jobs'])
+    if not local_video_path:
+        item['error'] = error
+        return False
+    item['local_path'] = local_video_path
+    item['video_url'] = external_video_url(item['y_id'], local_video_path)
+    item['ingest'] = 'local'
+    return True
 
-    # --- RUTUBE UPLOAD ---
-    if not is_video_synced(y_id, 'rutube'):
-        headers = {"Authorization": f"Token {token}"}
-        payload = {
-            "url": video_url,
-            "title": title,
-            "is_hidden": False,
-            "category_id": 13,
-            "description": description
-        }
+def post_to_rutube(item):
+    """
+    POST /api/video/ with item['video_url']. Returns the Rutube video ID or
+    None (the reason goes to item['error']).
+    """
+    try:
+        r = get_rutube_client().create_video(item['video_url'], item['title'], item['description'])
+    except requests.RequestException as e:
+        log(f"❌ Rutube API недоступен: {e}")
+        item['error'] = f"Rutube API: {e}"
+        return None
+    if r.status_code not in [200, 201]:
+        log(f"❌ Rutube API ошибка: {r.text}")
+        item['error'] = f"Rutube API {r.status_code}: {r.text[:500]}"
+        return None
 
-        try:
-            r = requests.post("https://rutube.ru/api/video/", json=payload, headers=headers)
-            if r.status_code in [200, 201]:
-                data = r.json()
-                rutube_video_id = data.get('id') or data.get('video_id')
-                
-                if not rutube_video_id:
-                    log(f"❌ ID видео не найден в ответе! Статус: {r.status_code}")
-                    return False
-                    
-                log(f"✅ Успешно отправлено на Rutube! ID: {rutube_video_id}")
-                mark_video_synced(y_id, title, 'rutube', description)
-                
-                # Ждем обработки и ставим кадр
-                if wait_for_processing(rutube_video_id, token):
-                    if set_cover_frame:
-                        try:
-                            set_cover_frame(rutube_video_id, title)
-                        except: pass
-            else:
-                log(f"❌ Rutube API ошибка: {r.text}")
-                return False
-        except Exception as e:
-            log(f"❌ Rutube API исключение: {e}")
-            return False
-    else:
+    data = r.json()
+    rutube_video_id = data.get('id') or data.get('video_id')
+    if not rutube_video_id:
+        log(f"❌ ID видео не найден в ответе! Статус: {r.status_code}")
+        item['error'] = f"Rutube API {r.status_code}: no video ID in the response"
+    return rutube_video_id
+
+def stage_publish(item):
+    if not item['needs_rutube']:
+        return item
+
+    y_id, title, description = item['y_id'], item['title'], item['description']
+    if is_video_synced(y_id, 'rutube'):
         log("ℹ️ Видео уже есть на Rutube, проверяем соцсети...")
+        finish_job(y_id, 'rutube')
+        release_video(y_id, 'rutube')
+        return item
+
+    rutube_video_id = post_to_rutube(item)
+    if not rutube_video_id and item.get('ingest') == 'direct':
+        log("↩️ Rutube не принял прямую ссылку, загружаем через локальный файл")
+        if not ingest_locally(item):
+            return False
+        rutube_video_id = post_to_rutube(item)
+    if not rutube_video_id:
+        return False
+        
+    log(f"✅ Успешно отправлено на Rutube! ID: {rutube_video_id}")
+    mark_video_synced(y_id, title, 'rutube', description)
+    finish_job(y_id, 'rutube')
+    item['rutube_id'] = rutube_video_id
+    get_reconciler().record(y_id, rutube_video_id)
+    # Обработку ждет фоновый трекер, пайплайн идет дальше
+    get_rutube_tracker().add(rutube_video_id, y_id, title, description, item.get('ingest'))
+    return item
+
+def get_rutube_tracker():
+    global rutube_tracker
+    if rutube_tracker is None:
+        rutube_tracker = RutubeTracker(init_db(), get_rutube_client(), log=log)
+    return rutube_tracker
+
+def on_rutube_ready(row):
+    """Tracker follow-up: the video is processed (ready or in moderation)"""
+    log(f"🎬 Rutube {row['rutube_id']} обработано ({row['y_id']})")
+    # Rutube забрал файл по ссылке, локальная копия ему больше не нужна
+    release_video(row['y_id'], 'rutube')
+    if set_cover_frame:
+        try:
+            set_cover_frame(row['rutube_id'], row['title'])
+        except: pass
+
+def unpublish_rutube(row, reason):
+    """The posted video never made it to Rutube: the video is no longer synced and its job is retried"""
+    y_id = row['y_id']
+    init_db().unmark_synced(y_id, 'rutube')
+    # Иначе find_on_rutube найдет видео по привязке и снова отметит его загруженным
+    get_reconciler().forget(y_id, row['rutube_id'])
+    if job_queue:
+        job_queue.requeue(y_id, 'rutube', reason)
+    release_video(y_id, 'rutube')
+    log(f"🔁 {y_id} снова в очереди на Rutube: {reason}")
+
+def on_rutube_failed(row):
+    """Tracker follow-up: Rutube could not process the video"""
+    if row['ingest'] != 'direct':
+        unpublish_rutube(row, f"Rutube {row['rutube_id']}: обработка не удалась")
+        return
+    # Rutube принял ссылку, но не смог ее скачать - повторяем через локальный файл
+    log(f"↩️ Импорт {row['y_id']} по прямой ссылке не удался, загружаем через локальный файл")
+    item = {'y_id': row['y_id'], 'title': row['title'], 'description': row['description'], 'jobs': {'rutube'}}
+    rutube_video_id = ingest_locally(item) and post_to_rutube(item)
+    if not rutube_video_id:
+        unpublish_rutube(row, f"Rutube {row['rutube_id']}: импорт по ссылке и загрузка файла не удались: "
+                              f"{item.get('error') or 'причина неизвестна'}")
+        return
+    log(f"✅ Повторно отправлено на Rutube! ID: {rutube_video_id}")
+    get_reconciler().record(row['y_id'], rutube_video_id)
+    get_rutube_tracker().add(rutube_video_id, row['y_id'], row['title'], row['description'], 'local')
+
+def on_rutube_expired(row):
+    """Tracker follow-up: the video was not processed within the tracker's max_age"""
+    unpublish_rutube(row, f"Rutube {row['rutube_id']}: не обработано вовремя")
+
+def stage_post_processing(item):
+    y_id, title, description = item['y_id'], item['title'], item['description']
 
     # --- TIKTOK UPLOAD ---
-    if not is_video_synced(y_id, 'tiktok'):
+    if item['needs_tiktok'] and not is_video_synced(y_id, 'tiktok'):
         if process_social_uploads:
             try:
                 log("📱 Загрузка в TikTok...")
-                # Передаем статус успеха в функцию соцсетей
-                success = process_social_uploads(local_video_path, title, description)
+                success = process_social_uploads(item['local_path'], title, description)
                 if success:
                     mark_video_synced(y_id, title, 'tiktok')
+                    finish_job(y_id, 'tiktok')
+                    release_video(y_id, 'tiktok')
                     log("✅ TikTok: Успешно!")
+                elif job_queue:
+                    job_queue.fail(y_id, 'tiktok', "TikTok upload failed")
             except Exception as e:
                 log(f"⚠️ Ошибка TikTok: {e}")
-    else:
+                if job_queue:
+                    job_queue.fail(y_id, 'tiktok', e)
+    elif not item['needs_tiktok']:
         log("ℹ️ Видео уже есть в TikTok.")
 
-        # Cleanup local file to save space
-        if os.path.exists(local_video_path):
-            try:
-                os.remove(local_video_path)
-                log(f"🗑️ Удален локальный файл: {local_video_path}")
-            except Exception as e:
-                log(f"⚠️ Ошибка удаления файла: {e}")
+    return None
 
+def get_channel_scanner():
+    global channel_scanner
+    if channel_scanner is None:
+        channel_scanner = ChannelScanner(init_db(), get_ytdlp(), SCAN_PAGE_SIZE,
+                                         backfill_page_size=BACKFILL_PAGE_SIZE,
+                                         backfill_page_interval=BACKFILL_PAGE_INTERVAL)
+    return channel_scanner
+
+def enqueue_videos(videos):
+    """Adds queue jobs for every platform where a video is not synced yet (batched)"""
+    statuses = get_sync_statuses([vid.get('id') for vid in videos])
+    jobs = []
+    for vid in videos:
+        y_id = vid.get('id')
+        payload = {
+            'title': vid.get('title'),
+            'description': vid.get('description'),
+            'upload_date': vid.get('upload_date'),
+        }
+        for platform in PLATFORMS:
+            if not statuses[y_id][platform]:
+                jobs.append((y_id, platform, payload))
+    return job_queue.enqueue_many(jobs)
+
+def scan_channel():
+    """
+    Scan stage: lists the channel and enqueues jobs for new work.
+    The Atom feed is checked first; yt-dlp lists the playlists only when it
+    shows unknown IDs, and each playlist only down to the first known video.
+    Returns True if the channel could be checked.
+    """
+    scanner = get_channel_scanner()
+    # Видео + Shorts
+    playlists = [
+        YOUTUBE_CHANNEL_URL,
+        YOUTUBE_CHANNEL_URL.rstrip('/') + '/shorts'
+    ]
+
+    feed = None
+    if YOUTUBE_FEED_URL and all(scanner.get_state(url) for url in playlists):
+        feed = FeedChecker(init_db(), YOUTUBE_FEED_URL)
+        feed_entries, feed_res = feed.fetch()
+        if feed_res is not None and feed_res.status_code == 304:
+            log("📡 Лента канала не изменилась, yt-dlp не запускаем")
+            playlists = []
+        elif feed_entries is None:
+            log("⚠️ Лента канала недоступна, сканируем плейлисты")
+            feed = None
+        else:
+            known = scanner.known_ids([e['id'] for e in feed_entries])
+            unknown = [e for e in feed_entries if e['id'] not in known]
+            if unknown:
+                log(f"📡 В ленте канала новых видео: {len(unknown)}")
+            else:
+                log("📡 В ленте канала нет новых видео, yt-dlp не запускаем")
+                playlists = []
+
+    for playlist_url in playlists:
+        log(f"🔎 Scanning playlist: {playlist_url}")
+    results = scanner.scan_many(playlists, SCAN_WORKERS)
+    failed = [url for url, (_, ok) in results.items() if not ok]
+    for playlist_url in failed:
+        log(f"⚠️ Warning: Could not scan {playlist_url}")
+    videos = merge_entries(*(entries for entries, ok in results.values() if ok))
+
+    if playlists and len(failed) == len(playlists):
+        log("❌ Не удалось получить список видео")
+        return False
+
+    # Валидаторы ленты сохраняем, только если все плейлисты прочитаны
+    if feed and feed_res.status_code == 200 and not failed:
+        # Записи ленты, которых нет в плейлистах (трансляции, премьеры), тоже
+        # считаем известными, иначе каждый запуск будет снова звать yt-dlp
+        scanner.remember(YOUTUBE_FEED_URL, feed_entries)
+        feed.save(feed_res)
+
+    log(f"🆕 Новых видео на канале: {len(videos)}")
+    # В очередь от старых к новым, чтобы публиковать в порядке выхода на YouTube
+    added = enqueue_videos(videos[::-1])
+    if added:
+        log(f"📥 Добавлено в очередь задач: {added}")
+
+    if job_queue.has_claimable():
         return True
-    
+
+    # Очередь пуста: используем запуск, чтобы пройти следующую страницу старых видео
+    old_videos = scanner.backfill_page(YOUTUBE_CHANNEL_URL)
+    if not old_videos:
+        log("✅ Все видео синхронизированы.")
+        return True
+
+    statuses = get_sync_statuses([vid.get('id') for vid in old_videos])
+    old_videos = [vid for vid in old_videos if not statuses[vid.get('id')]['rutube']]
+    for vid in old_videos:
+        log(f"🕰️ Найдено старое несинхронизированное видео: {vid.get('title')}")
+    enqueue_videos(old_videos)
+
+    if not job_queue.has_claimable():
+        log(f"✅ Страница старых видео уже синхронизирована (позиция {scanner.get_state(YOUTUBE_CHANNEL_URL)['backfill_offset']}).")
     return True
 
+def claim_items(stats):
+    """
+    Feeds the pipeline from the job queue, claiming one video at a time so
+    other worker processes can take the rest. Respects per-run limits.
+    """
+    rutube_count = 0
+    social_count = 0
+
+    while True:
+        rutube_ok = rutube_count < MAX_RUTUBE_UPLOADS_PER_RUN
+        social_ok = social_count < MAX_SOCIAL_UPLOADS_PER_RUN
+        if rutube_ok and social_ok:
+            claimed = job_queue.claim_next()
+        elif rutube_ok:
+            claimed = job_queue.claim_next(require_platforms=('rutube',))
+        elif social_ok:
+            claimed = job_queue.claim_next(exclude_platforms=('rutube',))
+        else:
+            log(f"🛑 Достигнут лимит за один запуск (Rutube: {rutube_count}, соцсети: {social_count}).")
+            return
+        if not claimed:
+            return
+
+        y_id, jobs = claimed
+        # Задачи могли устареть (видео отметили вручную или из tools/)
+        statuses = get_sync_statuses([y_id])[y_id]
+        for platform in list(jobs):
+            if statuses[platform]:
+                job_queue.complete(y_id, platform)
+                del jobs[platform]
+        if not jobs:
+            continue
+
+        if 'rutube' in jobs:
+            rutube_count += 1
+        else:
+            social_count += 1
+
+        stats['queued'] += 1
+        vid = dict(next(iter(jobs.values()))['payload'], id=y_id)
+        yield {'y_id': y_id, 'vid': vid, 'jobs': set(jobs),
+               'needs_rutube': 'rutube' in jobs, 'needs_tiktok': 'tiktok' in jobs}
+
+def with_lease(func):
+    """Renews the job lease before each stage so long runs don't lose their claim"""
+    def wrapper(item):
+        job_queue.renew(item['y_id'])
+        return func(item)
+    return wrapper
+
+def on_item_failure(item, stage_name, error):
+    # Видео уходит "на паузу" с экспоненциальной задержкой, остальные идут дальше
+    # Стадии, вернувшие False, кладут причину в item['error']
+    error = error or item.get('error') or f"{stage_name} stage failed"
+    next_attempt_at = job_queue.fail_video(item['y_id'], stage_name, error)
+    next_attempt = datetime.datetime.fromtimestamp(next_attempt_at).strftime('%Y-%m-%d %H:%M')
+    log(f"⏸️ {item['y_id']}: следующая попытка не раньше {next_attempt}")
+
 def sync():
-    processed_count = 0
+    global job_queue
     os.makedirs(UPLOADS_DIR, exist_ok=True)
-    init_db()
     setup_cookies()
+    job_queue = JobQueue(init_db())
+    for path in get_media_cache().prune(MEDIA_CACHE_MAX_AGE):
+        log(f"🗑️ Удален заброшенный файл из кэша: {path}")
     
     # Load metadata cache at start
     metadata_cache = load_metadata_cache()
-    log(f"📄 Загружен кэш с {len(metadata_cache)} видео")
+    log(f"📄 Загружен кэш с {metadata_cache.count()} видео")
     
+    scanned = scan_channel()
+    backing_off = job_queue.backing_off()
+    if backing_off:
+        log(f"⏸️ На паузе после ошибок: {len(backing_off)} видео ({', '.join(row[0] for row in backing_off[:5])})")
+    tracker = get_rutube_tracker()
+    if not job_queue.has_claimable() and not tracker.count():
+        # Частый опрос ленты не должен каждый раз логиниться в Rutube
+        log(f"💤 Нет задач к выполнению. Очередь задач: {job_queue.counts()}")
+        return scanned
+
     token = get_auth_token()
     if not token: 
         log("❌ Не удалось получить токен API")
         return False
 
-    # Простая проверка последних видео (Видео + Shorts)
-    playlists = [
-        YOUTUBE_CHANNEL_URL,
-        YOUTUBE_CHANNEL_URL.rstrip('/') + '/shorts'
-    ]
-    
-    videos = []
-    for playlist_url in playlists:
-        log(f"🔎 Scanning playlist: {playlist_url}")
-        cmd = [YT_DLP_PATH, "--dump-json", "--flat-playlist", "--playlist-end", "5"]
-        if COOKIE_FILE:
-             cmd.extend(["--cookies", COOKIE_FILE])
-        cmd.append(playlist_url)
-        
-        res = subprocess.run(cmd, capture_output=True, text=True)
-        if res.returncode == 0:
-            for line in res.stdout.strip().split("\n"):
-                if line: videos.append(json.loads(line))
-        else:
-            log(f"⚠️ Warning: Could not scan {playlist_url}")
+    if tracker.count():
+        log(f"⏳ Ожидают обработки на Rutube с прошлых запусков: {tracker.count()}")
+    tracker.start(on_rutube_ready, on_rutube_failed, on_rutube_expired)
+    if RUTUBE_DEDUPE and job_queue.has_claimable():
+        load_rutube_index()
 
-    if not videos:
-        log("❌ Не удалось получить список видео")
-        return False
-    
-    # 1. Проверяем top-5 (теперь из обоих списков)
-    processed_this_run = 0
-    for vid in videos:
-        y_id = vid.get('id')
-        
-        # Проверяем, нужно ли делать хоть что-то (Рутуб или ТикТок)
-        needs_rutube = not is_video_synced(y_id, 'rutube')
-        needs_tiktok = not is_video_synced(y_id, 'tiktok')
-        
-        if needs_rutube or needs_tiktok:
-            # Fetch full details with caching
-            full_info = get_full_video_info(y_id, metadata_cache)
-            
-            # Если Рутуб уже готов, а ТикТок еще нет - проверяем ориентацию ДО того как считать это "работой"
-            if not needs_rutube and needs_tiktok:
-                width = full_info.get('width', 0)
-                height = full_info.get('height', 0)
-                if width > height and width > 0:
-                    # log(f"📺 Пропускаем горизонтальное {y_id} для TikTok (Rutube уже есть)")
-                    mark_video_synced(y_id, vid.get('title'), 'tiktok', vid.get('description'))
-                    continue
-
-            log(f"🔎 Видео {y_id} требует внимания: Rutube={needs_rutube}, TikTok={needs_tiktok}")
-            
-            if full_info:
-                title = full_info.get('title', vid.get('title'))
-                description = full_info.get('description', vid.get('description', ''))
-            else:
-                title = vid.get('title')
-                description = vid.get('description', '')
-            
-            result = process_video(y_id, title, description, token)
-            save_metadata_cache(metadata_cache)
-            
-            if result is False:
-                log(f"❌ Failed to process video {y_id}")
-                return False
-            
-            processed_this_run += 1
-            if needs_rutube:
-                # Если загружали на Рутуб, то 1 за раз (лимит)
-                return True
-            
-            if processed_this_run >= 3:
-                # Если только соцсети - до 3 за раз
-                return True
-
-    # Если мы здесь, значит все top-5 уже синхронизированы.
-    if not videos:
-        log("⚠️ Не найдено видео на канале (список пуст).")
-        return True
+    pipeline = Pipeline([
+        Stage("metadata", with_lease(lambda item: stage_metadata(item, metadata_cache)), PIPELINE_WORKERS["metadata"], PIPELINE_QUEUE_SIZE),
+        Stage("download", with_lease(stage_download), PIPELINE_WORKERS["download"], PIPELINE_QUEUE_SIZE),
+        Stage("external_upload", with_lease(stage_external_upload), PIPELINE_WORKERS["external_upload"], PIPELINE_QUEUE_SIZE),
+        Stage("publish", with_lease(stage_publish), PIPELINE_WORKERS["publish"], PIPELINE_QUEUE_SIZE),
+        Stage("post_processing", with_lease(stage_post_processing), PIPELINE_WORKERS["post_processing"], PIPELINE_QUEUE_SIZE),
+    ], describe=describe_item, on_failure=on_item_failure)
 
-    # 2. Проверяем дату самого свежего видео
-    most_recent_date = None
-    for vid in videos:
-        d_str = vid.get('upload_date')
-        if d_str:
-            try:
-                d = datetime.datetime.strptime(d_str, "%Y%m%d")
-                if most_recent_date is None or d > most_recent_date:
-                    most_recent_date = d
-            except ValueError:
-                pass
-    
-    should_expand = False
-    if most_recent_date:
-        days_diff = (datetime.datetime.now() - most_recent_date).days
-        if days_diff > 7:
-            should_expand = True
-            log(f"🕵️ Последнее видео было {days_diff} дн. назад. Расширяем поиск...")
-    else:
-        should_expand = True
-    
-    if should_expand:
-        # 3. Расширенный поиск (50 видео)
-        cmd_expanded = [YT_DLP_PATH, "--dump-json", "--flat-playlist", "--playlist-end", "50"]
-        if COOKIE_FILE:
-            cmd_expanded.extend(["--cookies", COOKIE_FILE])
-        cmd_expanded.append(YOUTUBE_CHANNEL_URL)
-        
-        res_expanded = subprocess.run(cmd_expanded, capture_output=True, text=True)
-        
-        expanded_videos = []
-        for line in res_expanded.stdout.strip().split("\n"):
-            if line: expanded_videos.append(json.loads(line))
-        
-        for vid in expanded_videos:
-            if processed_count >= 3:
-                log("🛑 Достигнут лимит (3 видео) за один запуск.")
-                break
-
-            y_id = vid.get('id')
-            if not is_video_synced(y_id):
-                log(f"🕰️ Найдено старое несинхронизированное видео: {vid.get('title')}")
-                
-                full_info = get_full_video_info(y_id, metadata_cache)
-                if full_info:
-                    title = full_info.get('title', vid.get('title'))
-                    description = full_info.get('description', vid.get('description', ''))
-                else:
-                    title = vid.get('title')
-                    description = vid.get('description', '')
-                
-                result = process_video(y_id, title, description, token)
-                save_metadata_cache(metadata_cache)
-                if result:
-                    processed_count += 1
-                else:
-                    log(f"❌ Failed to process old video {y_id}")
-                    return False
-        
-        if processed_count > 0:
-            return True
-        
-        log("✅ Все видео из последних 50 уже синхронизированы.")
-    else:
-        log("✅ Все последние видео синхронизированы.")
-    
-    # Save cache before exit
-    save_metadata_cache(metadata_cache)
-    return True
+    prefetch_video_info(job_queue.claimable_ids(METADATA_PREFETCH_LIMIT), metadata_cache)
+
+    stats = {'queued': 0}
+    try:
+        try:
+            completed, failed = pipeline.run(claim_items(stats))
+        finally:
+            # Все, что мы не довели до конца, возвращаем в очередь
+            job_queue.release_owned()
+        left = tracker.drain(RUTUBE_PROCESSING_WAIT)
+    finally:
+        tracker.stop()
+    if left:
+        log(f"⏳ Еще обрабатываются на Rutube: {left}, проверим в следующий запуск")
+
+    log(f"📊 Итог: в работе {stats['queued']}, готово {len(completed)}, ошибок {len(failed)}")
+    for item, stage_name in failed:
+        log(f"❌ Failed to process video {item['y_id']} (стадия: {stage_name})")
+    log(f"📋 Очередь задач: {job_queue.counts()}")
+    log(f"📄 Кэш метаданных: {metadata_cache.stats_line()}")
+    return scanned and not failed
 
 if __name__ == "__main__":
     success = sync()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Data-access layer for the sync database (config.DB_FILE).
+
+One long-lived connection per process in WAL mode, shared between pipeline
+threads under a lock. WAL lets tools in tools/ read the DB while a sync run
+is writing to it.
+"""
+import contextlib
+import datetime
+import sqlite3
+import threading
+
+PLATFORMS = ('rutube', 'tiktok', 'insta')
+
+# SQLite limits the number of bound parameters per statement
+MAX_PARAMS = 500
+
+
+def chunked(items, size=MAX_PARAMS):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def status_column(platform):
+    if platform not in PLATFORMS:
+        raise ValueError(f"Unknown platform: {platform}")
+    return f"{platform}_status"
+
+
+class SyncStore:
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.lock = threading.RLock()
+        # autocommit mode: multi-statement writes go through transaction()
+        self.conn = sqlite3.connect(db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA busy_timeout=30000')
+        self.init_schema()
+
+    def init_schema(self):
+        with self.transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS synced (y_id TEXT PRIMARY KEY, title TEXT)')
+            conn.execute('CREATE TABLE IF NOT EXISTS publications (y_id TEXT PRIMARY KEY, title TEXT, description TEXT, rutube_status TEXT, tiktok_status TEXT, insta_status TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT under the connection lock (nested calls join the outer one)"""
+        with self.lock:
+            if self.conn.in_transaction:
+                yield self.conn
+                return
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def execute(self, sql, params=()):
+        """Runs one statement and returns the cursor (rowcount for writes)"""
+        with self.lock:
+            return self.conn.execute(sql, params)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        """
+        Checkpoints the WAL back into the main file before closing: the
+        workflow commits only sync_db.sqlite, not the -wal/-shm files.
+        """
+        with self.lock:
+            try:
+                self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error:
+                pass
+            self.conn.close()
+
+    # --- publications ---
+
+    def get_statuses(self, y_ids, platforms=PLATFORMS):
+        """
+        Returns {y_id: {platform: bool}} for all given IDs in one query per
+        MAX_PARAMS IDs. Unknown IDs are reported as not synced anywhere.
+        """
+        y_ids = list(dict.fromkeys(y_ids))
+        columns = [status_column(p) for p in platforms]
+        result = {y_id: {p: False for p in platforms} for y_id in y_ids}
+
+        for part in chunked(y_ids):
+            placeholders = ", ".join("?" * len(part))
+            rows = self.query(
+                f'SELECT y_id, {", ".join(columns)} FROM publications WHERE y_id IN ({placeholders})', part)
+            for row in rows:
+                result[row[0]] = {p: row[i + 1] is not None for i, p in enumerate(platforms)}
+        return result
+
+    def is_synced(self, y_id, platform='rutube'):
+        return self.get_statuses([y_id], (platform,))[y_id][platform]
+
+    def mark_synced_many(self, rows):
+        """
+        Batched upsert of status changes in one transaction.
+        rows: iterable of (y_id, title, platform, description_or_None)
+        """
+        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.transaction() as conn:
+            for y_id, title, platform, description in rows:
+                column = status_column(platform)
+                conn.execute(
+                    f'''INSERT INTO publications (y_id, title, description, {column}) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(y_id) DO UPDATE SET
+                            title = excluded.title,
+                            description = COALESCE(NULLIF(excluded.description, ''), publications.description),
+                            {column} = excluded.{column}''',
+                    (y_id, title, description, now))
+
+    def mark_synced(self, y_id, title, platform='rutube', description=None):
+        self.mark_synced_many([(y_id, title, platform, description)])
+
+    def unmark_synced(self, y_id, platform='rutube'):
+        """The publication was lost (e.g. Rutube failed to process it): the video is not synced there any more"""
+        self.execute(f'UPDATE publications SET {status_column(platform)} = NULL WHERE y_id = ?', (y_id,))
@@ -1,22 +1,20 @@
-import requests
 import sys
 import os
 import json
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
+from rutube_client import client_from_config
 
 def check_status(video_id):
-    r = requests.post("https://rutube.ru/api/accounts/token_auth/", data={'username': config.RUTUBE_LOGIN, 'password': config.RUTUBE_PASSWORD})
-    if r.status_code != 200:
-        print(f"Auth failed: {r.text}")
+    client = client_from_config(config)
+    if not client.get_token():
+        print("Auth failed")
         return
-    token = r.json().get('token')
     
-    headers = {"Authorization": f"Token {token}"}
     print(f"🔍 Checking status for {video_id}...")
     
-    r = requests.get(f"https://rutube.ru/api/video/{video_id}/", headers=headers)
+    r = client.get(f"/api/video/{video_id}/")
     
     if r.status_code == 200:
         print(json.dumps(r.json(), indent=2, ensure_ascii=False))
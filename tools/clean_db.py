@@ -1,57 +1,51 @@
-import sqlite3
-import requests
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
+from rutube_catalog import catalog_from_config
+from reconcile import Reconciler, youtube_videos_from_db
+from job_queue import JobQueue
 
-def get_rutube_titles():
-    # ... (Duplicate logic, simplified for brevity or reuse)
-    # Ideally import from find_missing_uploads but it's a script. 
-    # Copy-paste for safety to be self-contained.
-    
-    r = requests.post("https://rutube.ru/api/accounts/token_auth/", data={'username': config.RUTUBE_LOGIN, 'password': config.RUTUBE_PASSWORD})
-    if r.status_code != 200: return []
-    token = r.json().get('token')
-    
-    headers = {"Authorization": f"Token {token}"}
-    r = requests.get("https://rutube.ru/api/profile/user/", headers=headers)
-    if r.status_code != 200: 
-        r = requests.get("https://rutube.ru/api/accounts/profile/", headers=headers)
-    
-    if r.status_code != 200: return []
-    user_id = r.json().get('id')
-    
-    titles = set()
-    url = f"https://rutube.ru/api/video/person/{user_id}/?limit=50"
-    while url:
-        r = requests.get(url, headers=headers)
-        if r.status_code != 200: break
-        data = r.json()
-        for v in data.get('results', []):
-            titles.add(v.get('title'))
-        url = data.get('next')
-    return titles
+def get_catalog():
+    """Local catalog mirror, or None if it couldn't be refreshed"""
+    catalog = catalog_from_config(config)
+    _, ok = catalog.refresh(full=True if '--full' in sys.argv else None)
+    return catalog if ok else None
 
 def clean_db():
     print("Fetching Rutube videos...")
-    rutube_titles = get_rutube_titles()
+    catalog = get_catalog()
+    if catalog is None:
+        # С неполным каталогом удалили бы лишнее
+        print("❌ Rutube catalog refresh failed, nothing removed.")
+        return
+    
+    store = catalog.store
+    reconciler = Reconciler(store)
+    report = reconciler.reconcile(youtube_videos_from_db(store), catalog.videos())
+    reconciler.save(report['matched'])
     
-    conn = sqlite3.connect(config.DB_FILE)
-    cursor = conn.execute("SELECT y_id, title FROM synced")
-    synced_videos = cursor.fetchall()
+    # Возможные совпадения не трогаем: лучше проверить руками, чем загрузить дубль
+    for m in report['possible']:
+        print(f"❓ Keeping (possible match {m['confidence']:.2f}): {m['youtube_title']} ~ {m['rutube_title']}")
     
+    job_queue = JobQueue(store)
     removed_count = 0
-    for y_id, title in synced_videos:
-        if title not in rutube_titles:
-            print(f"🗑️ Removing from DB: {title} (ID: {y_id})")
-            conn.execute("DELETE FROM synced WHERE y_id=?", (y_id,))
+    with store.transaction() as conn:
+        for video in report['unmatched_youtube']:
+            print(f"🗑️ Removing from DB: {video['title']} (ID: {video['id']})")
+            conn.execute("UPDATE publications SET rutube_status = NULL WHERE y_id=?", (video['id'],))
+            conn.execute("DELETE FROM synced WHERE y_id=?", (video['id'],))
+            conn.execute("DELETE FROM video_mappings WHERE y_id=?", (video['id'],))
+            # Задача rutube уже выполнена: без этого видео больше не попадет в очередь
+            if not job_queue.reopen(video['id'], 'rutube'):
+                job_queue.enqueue(video['id'], 'rutube', {'title': video['title']})
+            job_queue.clear_failures(video['id'])
             removed_count += 1
-            
-    conn.commit()
-    conn.close()
+    
+    store.close()
     print(f"✅ Removed {removed_count} entries. Run the sync script now to re-upload them.")
 
 if __name__ == "__main__":
-    clean_db()
\ No newline at end of file
+    clean_db()
@@ -0,0 +1,49 @@
+import http.server
+import socketserver
+import email.utils
+import hashlib
+import os
+import sys
+
+# Локальная замена Atom-ленты YouTube для проверки быстрого пути sync_production.
+# Отдает XML-файл с ETag/Last-Modified и отвечает 304 на условные запросы.
+#
+# Usage: python3 tools/feed_stub_server.py <feed.xml> [port]
+# В config.py: YOUTUBE_FEED_URL = "http://127.0.0.1:8765/feed.xml"
+# Правка файла = "новое видео" на канале.
+
+FEED_FILE = sys.argv[1] if len(sys.argv) > 1 else "feed.xml"
+PORT = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            with open(FEED_FILE, 'rb') as f:
+                body = f.read()
+        except OSError:
+            self.send_error(404)
+            return
+
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        last_modified = email.utils.formatdate(os.path.getmtime(FEED_FILE), usegmt=True)
+
+        if self.headers.get('If-None-Match') == etag:
+            print(f"304 {self.path}")
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        print(f"200 {self.path} ({len(body)} bytes)")
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/atom+xml; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+
+if __name__ == "__main__":
+    with socketserver.TCPServer(("127.0.0.1", PORT), Handler) as httpd:
+        print(f"📡 Serving {FEED_FILE} on http://127.0.0.1:{PORT}/")
+        httpd.serve_forever()
@@ -1,62 +1,46 @@
-import sqlite3
-import requests
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
+from rutube_catalog import catalog_from_config
+from reconcile import Reconciler, youtube_videos_from_db
 
-def get_rutube_titles():
-    # ... (same auth logic)
-    r = requests.post("https://rutube.ru/api/accounts/token_auth/", data={'username': config.RUTUBE_LOGIN, 'password': config.RUTUBE_PASSWORD})
-    if r.status_code != 200: return []
-    token = r.json().get('token')
-    
-    headers = {"Authorization": f"Token {token}"}
-    r = requests.get("https://rutube.ru/api/profile/user/", headers=headers)
-    if r.status_code != 200: 
-        r = requests.get("https://rutube.ru/api/accounts/profile/", headers=headers)
-        
-    if r.status_code != 200: return []
-    user_id = r.json().get('id')
-    
-    titles = set()
-    # Fetch all pages
-    url = f"https://rutube.ru/api/video/person/{user_id}/?limit=50"
-    while url:
-        r = requests.get(url, headers=headers)
-        if r.status_code != 200: break
-        data = r.json()
-        for v in data.get('results', []):
-            titles.add(v.get('title'))
-        
-        url = data.get('next') # Pagination
-    return titles
+def get_catalog():
+    # Локальное зеркало каталога, с API дочитываются только новые страницы (--full - все)
+    catalog = catalog_from_config(config)
+    _, ok = catalog.refresh(full=True if '--full' in sys.argv else None)
+    if not ok:
+        print("⚠️ Rutube catalog refresh failed, using the local mirror as is")
+    return catalog
 
 def check_db():
-    conn = sqlite3.connect(config.DB_FILE)
-    cursor = conn.execute("SELECT y_id, title FROM synced")
-    synced_videos = cursor.fetchall()
-    conn.close()
+    catalog = get_catalog()
+    synced_videos = youtube_videos_from_db(catalog.store)
     
-    rutube_titles = get_rutube_titles()
-    
-    print(f"Found {len(rutube_titles)} videos on Rutube.")
+    print(f"Found {catalog.count()} videos on Rutube.")
     print(f"Found {len(synced_videos)} synced videos in DB.")
     
-    missing = []
-    for y_id, title in synced_videos:
-        # Check if title exists in Rutube list
-        # We use exact match because the bot uploads exact title.
-        if title not in rutube_titles:
-            missing.append((y_id, title))
-            
+    # Сопоставление по нормализованному названию, длительности и дате, а не точному названию
+    reconciler = Reconciler(catalog.store)
+    report = reconciler.reconcile(synced_videos, catalog.videos())
+    reconciler.save(report['matched'])
+    print(f"Matched: {len(report['mapped'])} known, {len(report['matched'])} new (saved to video_mappings)")
+    
+    if report['possible']:
+        print("\n--- Possible matches (check by hand) ---")
+        for m in report['possible']:
+            print(f"❓ {m['youtube_title']} (ID: {m['y_id']}) ~ {m['rutube_title']} "
+                  f"(Rutube: {m['rutube_id']}, confidence {m['confidence']:.2f})")
+    
+    missing = report['unmatched_youtube']
     print("\n--- Videos marked as synced but NOT found on Rutube ---")
-    for y_id, title in missing:
-        print(f"❌ {title} (ID: {y_id})")
+    for video in missing:
+        print(f"❌ {video['title']} (ID: {video['id']})")
         
     if missing:
         print("\nTo fix this, run: python3 tools/clean_db.py")
+    catalog.store.close()
 
 if __name__ == "__main__":
     check_db()
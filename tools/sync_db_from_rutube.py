@@ -1,5 +1,3 @@
-import sqlite3
-import requests
 import subprocess
 import json
 import sys
@@ -7,34 +5,17 @@ import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import config
+from rutube_catalog import catalog_from_config
+from reconcile import Reconciler
 
-def get_rutube_videos():
+def get_catalog():
     print("🌍 Fetching Rutube videos...")
-    r = requests.post("https://rutube.ru/api/accounts/token_auth/", data={'username': config.RUTUBE_LOGIN, 'password': config.RUTUBE_PASSWORD})
-    if r.status_code != 200: 
-        print("❌ Auth failed")
-        return []
-    token = r.json().get('token')
-    
-    headers = {"Authorization": f"Token {token}"}
-    r = requests.get("https://rutube.ru/api/profile/user/", headers=headers)
-    if r.status_code != 200: 
-        r = requests.get("https://rutube.ru/api/accounts/profile/", headers=headers)
-    
-    if r.status_code != 200: return []
-    user_id = r.json().get('id')
-    
-    videos = []
-    url = f"https://rutube.ru/api/video/person/{user_id}/?limit=50"
-    while url:
-        r = requests.get(url, headers=headers)
-        if r.status_code != 200: break
-        data = r.json()
-        for v in data.get('results', []):
-            videos.append(v)
-        url = data.get('next')
-    print(f"✅ Found {len(videos)} videos on Rutube.")
-    return videos
+    catalog = catalog_from_config(config)
+    _, ok = catalog.refresh(full=True if '--full' in sys.argv else None)
+    if not ok:
+        print("⚠️ Rutube catalog refresh failed, using the local mirror as is")
+    print(f"✅ Found {catalog.count()} videos on Rutube.")
+    return catalog
 
 def get_youtube_videos():
     print("🌍 Fetching YouTube videos...")
@@ -47,35 +28,29 @@ def get_youtube_videos():
     return videos
 
 def sync_db():
-    rutube_vids = get_rutube_videos()
+    catalog = get_catalog()
     youtube_vids = get_youtube_videos()
+    store = catalog.store
+    
+    # Уже отмеченные в БД пропускаем
+    statuses = store.get_statuses([v.get('id') for v in youtube_vids], ('rutube',))
+    youtube_vids = [v for v in youtube_vids if not statuses[v.get('id')]['rutube']]
+    
+    # Сопоставление по нормализованному названию, длительности и дате (см. reconcile.py)
+    reconciler = Reconciler(store)
+    report = reconciler.reconcile(youtube_vids, catalog.videos())
     
-    # Create map Title -> Rutube Video
-    # Note: Titles must match exactly.
-    rutube_map = {v.get('title'): v for v in rutube_vids}
+    matches = report['mapped'] + report['matched']
+    for m in matches:
+        print(f"🔗 Match found ({m['confidence']:.2f})! Marking as synced: {m['youtube_title']} -> {m['rutube_id']}")
+    reconciler.save(report['matched'])
+    store.mark_synced_many([(m['y_id'], m['youtube_title'], 'rutube', None) for m in matches])
     
-    conn = sqlite3.connect(config.DB_FILE)
-    conn.execute('CREATE TABLE IF NOT EXISTS synced (y_id TEXT PRIMARY KEY, title TEXT)')
+    for m in report['possible']:
+        print(f"❓ Possible match ({m['confidence']:.2f}), not marked: {m['youtube_title']} ~ {m['rutube_title']}")
     
-    added_count = 0
-    for yt_vid in youtube_vids:
-        title = yt_vid.get('title')
-        y_id = yt_vid.get('id')
-        
-        # Check if already synced in DB
-        cursor = conn.execute('SELECT 1 FROM synced WHERE y_id=?', (y_id,))
-        if cursor.fetchone():
-            continue
-            
-        # Check if exists on Rutube
-        if title in rutube_map:
-            print(f"🔗 Match found! Marking as synced: {title}")
-            conn.execute('INSERT OR REPLACE INTO synced VALUES (?, ?)', (y_id, title))
-            added_count += 1
-            
-    conn.commit()
-    conn.close()
-    print(f"🎉 Synced {added_count} videos from Rutube to local DB.")
+    store.close()
+    print(f"🎉 Synced {len(matches)} videos from Rutube to local DB.")
 
 if __name__ == "__main__":
     sync_db()
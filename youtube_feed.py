@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Cheap new-upload check against the channel's public Atom feed.
+
+The feed lists the latest ~15 uploads (videos and shorts). It is fetched with
+a conditional GET: the ETag / Last-Modified of the last processed response
+are kept in feed_state, so an unchanged feed costs one 304 and no yt-dlp
+start at all.
+"""
+import re
+import time
+import xml.etree.ElementTree as ET
+
+import requests
+
+FEED_URL = "https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS feed_state (
+    feed_url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    checked_at REAL
+)
+'''
+
+NS = {
+    'atom': 'http://www.w3.org/2005/Atom',
+    'yt': 'http://www.youtube.com/xml/schemas/2015',
+}
+
+
+def feed_url_for(channel_url):
+    """Feed URL for a /channel/UC... URL, None for handles and custom URLs"""
+    m = re.search(r"/channel/(UC[\w-]{22})", channel_url or "")
+    return FEED_URL.format(channel_id=m.group(1)) if m else None
+
+
+def parse_feed(xml_text):
+    """Entries in feed order (newest first), shaped like flat-playlist entries"""
+    root = ET.fromstring(xml_text)
+    entries = []
+    for entry in root.findall('atom:entry', NS):
+        y_id = entry.findtext('yt:videoId', namespaces=NS)
+        if not y_id:
+            continue
+        published = entry.findtext('atom:published', namespaces=NS) or ''
+        entries.append({
+            'id': y_id,
+            'title': entry.findtext('atom:title', namespaces=NS),
+            'upload_date': published[:10].replace('-', '') or None,
+        })
+    return entries
+
+
+class FeedChecker:
+    def __init__(self, store, feed_url, timeout=15):
+        """
+        :param store: SyncStore (общее соединение с DB_FILE)
+        :param feed_url: URL Atom-ленты канала
+        """
+        self.store = store
+        self.feed_url = feed_url
+        self.timeout = timeout
+        with store.transaction() as conn:
+            conn.execute(SCHEMA)
+
+    def validators(self):
+        rows = self.store.query('SELECT etag, last_modified FROM feed_state WHERE feed_url = ?', (self.feed_url,))
+        return rows[0] if rows else (None, None)
+
+    def fetch(self):
+        """
+        Conditional GET of the feed. Returns (entries, response):
+        entries is None when the feed is unchanged (304) or could not be read.
+        """
+        etag, last_modified = self.validators()
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        try:
+            res = requests.get(self.feed_url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            return None, None
+        if res.status_code != 200:
+            return None, res
+        try:
+            return parse_feed(res.content), res
+        except ET.ParseError:
+            return None, res
+
+    def save(self, res):
+        """Stores the validators of a processed response (call after the scan succeeded)"""
+        self.store.execute(
+            '''INSERT INTO feed_state (feed_url, etag, last_modified, checked_at) VALUES (?, ?, ?, ?)
+               ON CONFLICT(feed_url) DO UPDATE SET
+                   etag = excluded.etag,
+                   last_modified = excluded.last_modified,
+                   checked_at = excluded.checked_at''',
+            (self.feed_url, res.headers.get('ETag'), res.headers.get('Last-Modified'), time.time()))
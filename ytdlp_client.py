@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+Thin wrapper around yt-dlp.
+
+When the `yt_dlp` module is installed, calls go through its Python API and
+the YoutubeDL instances are kept for the whole run (one pool per option set),
+so the interpreter start, extractor import and JS runtime spin-up are paid
+once instead of on every call. Without the module it falls back to spawning
+the binary, exactly like before.
+"""
+import concurrent.futures
+import contextlib
+import json
+import re
+import shutil
+import subprocess
+import threading
+
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
+DEFAULT_FORMAT = "best[ext=mp4]/best"
+# DEFAULT_FORMAT - один progressive-файл, а не фрагменты: concurrent_fragment_downloads
+# его не ускоряет. Встроенный загрузчик качает его кусками по HTTP_CHUNK_SIZE
+# (отдельный Range-запрос на кусок, YouTube меньше режет скорость), параллельно - только aria2c
+HTTP_CHUNK_SIZE = 10 * 1024 * 1024
+
+
+class _QuietLogger:
+    """Keeps yt-dlp from printing to stdout; errors come back as exceptions"""
+    def debug(self, msg): pass
+    def info(self, msg): pass
+    def warning(self, msg): pass
+    def error(self, msg): pass
+
+
+class BandwidthBudget:
+    """
+    Global download rate limit shared by all concurrent downloads.
+
+    Every active download gets an equal share. In-process native downloads
+    read `ratelimit` from their params on every chunk, so their share is
+    rebalanced live when a download starts or ends; the binary and aria2c
+    get the share current at their start.
+    """
+    def __init__(self, total_rate=None):
+        """
+        :param total_rate: Общий лимит в байтах/сек (None = без лимита)
+        """
+        self.total_rate = total_rate
+        self._active = []
+        self._lock = threading.Lock()
+
+    def share(self, extra=0):
+        if not self.total_rate:
+            return None
+        return max(1, int(self.total_rate / max(1, len(self._active) + extra)))
+
+    def _rebalance(self):
+        rate = self.share()
+        for params in self._active:
+            params['ratelimit'] = rate
+
+    @contextlib.contextmanager
+    def slot(self, params):
+        """Registers a download whose `params['ratelimit']` follows its share"""
+        with self._lock:
+            self._active.append(params)
+            self._rebalance()
+        try:
+            yield params.get('ratelimit')
+        finally:
+            with self._lock:
+                # params сравниваются по содержимому, удаляем по identity
+                self._active = [p for p in self._active if p is not params]
+                params['ratelimit'] = None
+                self._rebalance()
+
+
+class YtDlpClient:
+    def __init__(self, binary_path, cookie_file=None, mode="auto", user_agent=USER_AGENT, js_runtime="deno",
+                 download_engine="native", download_connections=1, bandwidth=None):
+        """
+        :param binary_path: Путь к бинарнику yt-dlp (fallback)
+        :param cookie_file: Файл куки YouTube (Netscape) или None
+        :param mode: "auto" (модуль, если установлен), "module" или "binary"
+        :param download_engine: "native" (yt-dlp), "aria2c" или "auto" (aria2c, если он установлен
+                                и download_connections > 1)
+        :param download_connections: Число параллельных соединений на одно скачивание; у "native"
+                                     действует только на фрагментированные форматы (DASH/HLS)
+        :param bandwidth: BandwidthBudget, общий для всех скачиваний (или None)
+        """
+        self.binary_path = binary_path
+        self.cookie_file = cookie_file
+        self.user_agent = user_agent
+        self.js_runtime = js_runtime
+        if download_engine not in ("auto", "native", "aria2c"):
+            raise ValueError(f"Unknown download engine: {download_engine}")
+        self.download_connections = max(1, download_connections)
+        if download_engine == "auto":
+            download_engine = "aria2c" if self.download_connections > 1 and shutil.which("aria2c") else "native"
+        self.download_engine = download_engine
+        self.bandwidth = bandwidth or BandwidthBudget()
+        if mode == "module" and yt_dlp is None:
+            raise ImportError("yt_dlp module is not installed")
+        self.in_process = mode != "binary" and yt_dlp is not None
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    @property
+    def mode(self):
+        return "module" if self.in_process else "binary"
+
+    # --- in-process ---
+
+    def _params(self, player_client=None, browser_like=True, **extra):
+        params = {
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'logger': _QuietLogger(),
+        }
+        if browser_like:
+            params['nocheckcertificate'] = True
+            params['http_headers'] = {'User-Agent': self.user_agent}
+            if self.js_runtime:
+                params['js_runtimes'] = {self.js_runtime: {}}
+        if player_client:
+            params['extractor_args'] = {'youtube': {
+                'player_client': player_client.split(','),
+                'player_skip': ['webpage', 'configs'],
+            }}
+        if self.cookie_file:
+            params['cookiefile'] = self.cookie_file
+        params.update(extra)
+        return params
+
+    @contextlib.contextmanager
+    def _borrow(self, params):
+        """
+        Takes an idle YoutubeDL for this option set from the pool (or creates one).
+        YoutubeDL is not thread-safe, so each instance serves one call at a time.
+        """
+        key = repr(sorted((k, v) for k, v in params.items() if k != 'logger'))
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            ydl = pool.pop() if pool else None
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(params)
+        try:
+            yield ydl
+        finally:
+            with self._lock:
+                self._pools[key].append(ydl)
+
+    # --- public API ---
+
+    def extract_video(self, y_id, player_client=None, timeout=45):
+        """Full metadata (like --dump-json). Returns (info, error)."""
+        url = f"https://youtube.com/watch?v={y_id}"
+        if self.in_process:
+            params = self._params(player_client, socket_timeout=timeout)
+            try:
+                with self._borrow(params) as ydl:
+                    info = ydl.extract_info(url, download=False)
+                    return ydl.sanitize_info(info), None
+            except Exception as e:
+                return None, str(e).split('\n')[0]
+
+        cmd = [
+            self.binary_path,
+            "--dump-json",
+            "--no-check-certificates",
+        ]
+        if player_client:
+            cmd.extend(["--extractor-args", f"youtube:player_client={player_client};player_skip=webpage,configs"])
+        if self.js_runtime:
+            cmd.extend(["--js-runtimes", self.js_runtime])
+        cmd.extend(["--user-agent", self.user_agent])
+        if self.cookie_file:
+            cmd.extend(["--cookies", self.cookie_file])
+        cmd.append(url)
+
+        try:
+            res = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return None, f"timeout after {timeout}s"
+        if res.returncode == 0:
+            return json.loads(res.stdout), None
+        return None, res.stderr.split('\n')[0] if res.stderr else "Unknown error"
+
+    def extract_videos(self, y_ids, player_client=None, timeout=45, workers=4):
+        """
+        Batched metadata fetch. Returns (results, failures):
+        {y_id: info} and {y_id: error} - one failing ID doesn't spoil the batch.
+
+        In-process: a bounded pool of `workers` threads, each reusing a pooled
+        YoutubeDL. Binary: one yt-dlp invocation for all URLs (--ignore-errors).
+        """
+        y_ids = list(dict.fromkeys(y_ids))
+        results, failures = {}, {}
+        if not y_ids:
+            return results, failures
+
+        if self.in_process:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                futures = {pool.submit(self.extract_video, y_id, player_client, timeout): y_id for y_id in y_ids}
+                for future in concurrent.futures.as_completed(futures):
+                    y_id = futures[future]
+                    info, error = future.result()
+                    if info:
+                        results[y_id] = info
+                    else:
+                        failures[y_id] = error
+            return results, failures
+
+        cmd = [
+            self.binary_path,
+            "--dump-json",
+            "--ignore-errors",
+            "--no-check-certificates",
+        ]
+        if player_client:
+            cmd.extend(["--extractor-args", f"youtube:player_client={player_client};player_skip=webpage,configs"])
+        if self.js_runtime:
+            cmd.extend(["--js-runtimes", self.js_runtime])
+        cmd.extend(["--user-agent", self.user_agent])
+        if self.cookie_file:
+            cmd.extend(["--cookies", self.cookie_file])
+        cmd.extend(f"https://youtube.com/watch?v={y_id}" for y_id in y_ids)
+
+        try:
+            res = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout * len(y_ids))
+            stdout, stderr = res.stdout, res.stderr
+        except subprocess.TimeoutExpired as e:
+            stdout = e.stdout.decode() if isinstance(e.stdout, bytes) else (e.stdout or "")
+            stderr = f"timeout after {timeout * len(y_ids)}s"
+
+        for line in stdout.strip().split("\n"):
+            if not line:
+                continue
+            try:
+                info = json.loads(line)
+            except ValueError:
+                continue
+            if info.get('id') in y_ids:
+                results[info['id']] = info
+
+        # "ERROR: [youtube] <id>: <reason>" - ошибки по конкретным ID
+        errors = {}
+        for line in (stderr or "").split("\n"):
+            m = re.match(r"ERROR: \[\w+\] ([\w-]{11}): (.*)", line)
+            if m:
+                errors[m.group(1)] = line
+        for y_id in y_ids:
+            if y_id not in results:
+                failures[y_id] = errors.get(y_id) or (stderr or "").split("\n")[0] or "Unknown error"
+        return results, failures
+
+    def direct_url(self, y_id, format=DEFAULT_FORMAT, player_client=None, timeout=45):
+        """Direct media URL of the selected format (like -g). Returns (url, error)."""
+        url = f"https://youtube.com/watch?v={y_id}"
+        if self.in_process:
+            params = self._params(player_client, format=format, socket_timeout=timeout)
+            try:
+                with self._borrow(params) as ydl:
+                    info = ydl.extract_info(url, download=False)
+            except Exception as e:
+                return None, str(e).split('\n')[0]
+            # Раздельные видео+аудио (requested_formats) одной ссылкой не отдать
+            if not info.get('url'):
+                return None, "format has no single direct URL"
+            return info['url'], None
+
+        cmd = [self.binary_path, "-g", "-f", format, "--no-check-certificates"]
+        if player_client:
+            cmd.extend(["--extractor-args", f"youtube:player_client={player_client};player_skip=webpage,configs"])
+        if self.js_runtime:
+            cmd.extend(["--js-runtimes", self.js_runtime])
+        cmd.extend(["--user-agent", self.user_agent])
+        if self.cookie_file:
+            cmd.extend(["--cookies", self.cookie_file])
+        cmd.append(url)
+        try:
+            res = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return None, f"timeout after {timeout}s"
+        lines = res.stdout.strip().split("\n")
+        if res.returncode != 0 or len(lines) != 1 or not lines[0]:
+            return None, res.stderr.split('\n')[0] if res.stderr else "format has no single direct URL"
+        return lines[0], None
+
+    def list_playlist(self, playlist_url, start=1, end=5):
+        """
+        Flat playlist listing (like --flat-playlist --dump-json). Returns (entries, ok).
+        Entries of channel tabs carry an approximate upload_date ("3 days ago"),
+        without it flat entries have no date at all.
+        """
+        if self.in_process:
+            params = self._params(browser_like=False, extract_flat='in_playlist',
+                                  playliststart=start, playlistend=end,
+                                  extractor_args={'youtubetab': {'approximate_date': ['']}})
+            try:
+                with self._borrow(params) as ydl:
+                    info = ydl.sanitize_info(ydl.extract_info(playlist_url, download=False))
+                return [e for e in (info.get('entries') or []) if e], True
+            except Exception:
+                return [], False
+
+        cmd = [self.binary_path, "--dump-json", "--flat-playlist",
+               "--playlist-start", str(start), "--playlist-end", str(end),
+               "--extractor-args", "youtubetab:approximate_date"]
+        if self.cookie_file:
+            cmd.extend(["--cookies", self.cookie_file])
+        cmd.append(playlist_url)
+
+        res = subprocess.run(cmd, capture_output=True, text=True)
+        entries = []
+        for line in res.stdout.strip().split("\n"):
+            if line: entries.append(json.loads(line))
+        return entries, res.returncode == 0
+
+    @contextlib.contextmanager
+    def stream(self, y_id, format=DEFAULT_FORMAT, player_client="tv,ios,android", retries=3):
+        """
+        Starts yt-dlp writing the video to stdout (-o -) and yields the Popen.
+        Always the binary: the Python API can't write into a pipe. The format
+        must be a single file (no separate video+audio merge). The download
+        holds a BandwidthBudget slot until the process is reaped on exit
+        (killed if it is still running).
+        """
+        cmd = [
+            self.binary_path,
+            "-f", format,
+            "-o", "-",
+            "--quiet", "--no-warnings",
+            "--no-check-certificates",
+        ]
+        if player_client:
+            cmd.extend(["--extractor-args", f"youtube:player_client={player_client};player_skip=webpage,configs"])
+        if self.js_runtime:
+            cmd.extend(["--js-runtimes", self.js_runtime])
+        cmd.extend(["--user-agent", self.user_agent, "--retries", str(retries)])
+        if self.cookie_file:
+            cmd.extend(["--cookies", self.cookie_file])
+        cmd.append(f"https://youtube.com/watch?v={y_id}")
+        with self.bandwidth.slot({}) as rate:
+            if rate:
+                cmd[-1:-1] = ["--limit-rate", str(rate)]
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            try:
+                yield proc
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                proc.wait()
+
+    def _aria2c_args(self):
+        n = str(self.download_connections)
+        return ["-x", n, "-s", n, "-k", "1M"]
+
+    def download(self, y_id, outtmpl, format=DEFAULT_FORMAT, player_client="tv,ios,android", retries=3):
+        """
+        Downloads one video to `outtmpl` (yt-dlp output template). Returns (info, error);
+        info is the metadata of the downloaded format (filesize etc.) or None on failure.
+        An interrupted download leaves `<file>.part`, the next call resumes it.
+        """
+        url = f"https://youtube.com/watch?v={y_id}"
+        engine = {'concurrent_fragment_downloads': self.download_connections}
+        if self.download_engine == "aria2c":
+            engine['external_downloader'] = {'default': 'aria2c'}
+            engine['external_downloader_args'] = {'aria2c': self._aria2c_args()}
+        else:
+            engine['http_chunk_size'] = HTTP_CHUNK_SIZE
+
+        if self.in_process:
+            params = self._params(player_client, format=format, outtmpl=outtmpl, retries=retries,
+                                  continuedl=True, **engine)
+            try:
+                with self._borrow(params) as ydl, self.bandwidth.slot(ydl.params):
+                    return ydl.sanitize_info(ydl.extract_info(url, download=True)), None
+            except Exception as e:
+                return None, str(e).split('\n')[0]
+
+        cmd = [
+            self.binary_path,
+            "-f", format,
+            "-o", outtmpl,
+            "--continue",
+            "-N", str(self.download_connections),
+            # JSON выбранного формата печатается после скачивания
+            "--dump-json", "--no-simulate",
+            "--no-check-certificates",
+        ]
+        if player_client:
+            cmd.extend(["--extractor-args", f"youtube:player_client={player_client};player_skip=webpage,configs"])
+        if self.js_runtime:
+            cmd.extend(["--js-runtimes", self.js_runtime])
+        cmd.extend(["--user-agent", self.user_agent, "--retries", str(retries)])
+        if self.download_engine == "aria2c":
+            cmd.extend(["--downloader", "aria2c", "--downloader-args", "aria2c:" + " ".join(self._aria2c_args())])
+        else:
+            cmd.extend(["--http-chunk-size", str(HTTP_CHUNK_SIZE)])
+        if self.cookie_file:
+            cmd.extend(["--cookies", self.cookie_file])
+        cmd.append(url)
+        with self.bandwidth.slot({}) as rate:
+            if rate:
+                cmd[-1:-1] = ["--limit-rate", str(rate)]
+            res = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
+        if res.returncode != 0:
+            return None, f"yt-dlp exit code {res.returncode}"
+        try:
+            return json.loads(res.stdout.strip().split("\n")[-1]), None
+        except ValueError:
+            return {}, None